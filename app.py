@@ -2,11 +2,20 @@ import os
 import uuid
 import json
 import hashlib
+import argparse
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
 from urllib.parse import urlparse
 
 import requests
 
+FETCH_WORKERS = 8
+FETCH_CHUNK = 64 * 1024
+FETCH_MAX_BYTES = 64 * 1024 * 1024  # abort sources larger than this (0 = no limit)
+
+
 class C:
     RESET = "\033[0m"
     BOLD = "\033[1m"
@@ -50,12 +59,17 @@ def manifest_path(day_dir: str) -> str:
     return os.path.join(day_dir, "_manifest.json")
 
 
+def _manifest_entry(v) -> dict:
+    # manifests written before conditional fetching stored just the path
+    return {"path": v} if isinstance(v, str) else dict(v)
+
+
 def load_manifest(day_dir: str) -> dict:
     p = manifest_path(day_dir)
     if os.path.isfile(p):
         try:
             with open(p, "r", encoding="utf-8") as f:
-                return json.load(f)
+                return {url: _manifest_entry(v) for url, v in json.load(f).items()}
         except Exception:
             return {}
     return {}
@@ -67,44 +81,143 @@ def save_manifest(day_dir: str, data: dict) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
-def download_all_once_per_day(urls, day_dir, timeout=30, skip_if_downloaded_today=True):
-    man = load_manifest(day_dir)
-    results = []
+def load_previous_manifests(day_dir: str) -> dict:
+    # newest entry per URL from earlier day folders, so a new day can still revalidate
+    base_dir, today = os.path.split(os.path.normpath(day_dir))
+    merged = {}
+    if not os.path.isdir(base_dir):
+        return merged
+    for name in sorted(os.listdir(base_dir)):
+        if name >= today or not os.path.isdir(os.path.join(base_dir, name)):
+            continue
+        for url, entry in load_manifest(os.path.join(base_dir, name)).items():
+            if entry.get("path") and os.path.isfile(entry["path"]):
+                merged[url] = entry
+    return merged
+
+
+def make_session(workers: int) -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": "configs-fetcher/1.0", "Accept": "*/*"})
+    return session
+
+
+class SourceTooLarge(Exception):
+    pass
+
+
+def stream_to_file(r, out_path, max_bytes):
+    # write to a temp file next to out_path, hashing as we go, then rename into place
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path) or ".", prefix=".part_", suffix=".tmp")
+    h = hashlib.sha1()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in r.iter_content(chunk_size=FETCH_CHUNK):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise SourceTooLarge(f"source larger than {max_bytes} bytes")
+                h.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return size, h.hexdigest()
+
+
+def fetch_one(session, url, day_dir, prev, timeout, max_bytes=FETCH_MAX_BYTES):
+    out_path = os.path.join(day_dir, stable_name_for_url(url))
+
+    headers = {}
+    if prev and prev.get("etag"):
+        headers["If-None-Match"] = prev["etag"]
+    if prev and prev.get("last_modified"):
+        headers["If-Modified-Since"] = prev["last_modified"]
+
+    try:
+        with session.get(url, timeout=timeout, headers=headers, stream=True) as r:
+            if r.status_code == 304 and prev:
+                if os.path.abspath(prev["path"]) != os.path.abspath(out_path):
+                    shutil.copyfile(prev["path"], out_path)
+                entry = dict(prev, path=out_path)
+                size = os.path.getsize(out_path)
+                return {"url": url, "path": out_path, "bytes": size, "saved": size, "status": "unchanged", "error": None}, entry
 
-    headers = {
-        "User-Agent": "configs-fetcher/1.0",
-        "Accept": "*/*",
-    }
+            r.raise_for_status()
+            try:
+                declared = int(r.headers.get("Content-Length") or 0)
+            except ValueError:  # malformed header: size unknown, stream_to_file enforces the limit
+                declared = 0
+            if max_bytes and declared > max_bytes:
+                raise SourceTooLarge(f"source is {declared} bytes, limit is {max_bytes}")
+
+            size, digest = stream_to_file(r, out_path, max_bytes)
+
+        entry = {
+            "path": out_path,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "bytes": size,
+            "sha1": digest,
+        }
+        status = "unchanged" if prev and prev.get("sha1") == digest else "downloaded"
+        return {"url": url, "path": out_path, "bytes": size, "saved": 0, "status": status, "error": None}, entry
+
+    except (requests.RequestException, OSError, SourceTooLarge) as e:
+        return {"url": url, "path": None, "bytes": 0, "saved": 0, "status": "failed", "error": str(e)}, None
+
+
+def download_all_once_per_day(
+    urls,
+    day_dir,
+    timeout=30,
+    skip_if_downloaded_today=True,
+    workers=FETCH_WORKERS,
+    max_bytes=FETCH_MAX_BYTES,
+):
+    man = load_manifest(day_dir)
+    previous = load_previous_manifests(day_dir)
+    results = {}
+    todo = []
 
     for url in urls:
-        out_path = os.path.join(day_dir, stable_name_for_url(url))
-
-        if skip_if_downloaded_today:
-            prev = man.get(url)
-            if prev and os.path.isfile(prev):
-                results.append(
-                    {"url": url, "path": prev, "bytes": os.path.getsize(prev), "status": "skipped", "error": None}
-                )
-                continue
-
+        prev = man.get(url)
+        if skip_if_downloaded_today and prev and os.path.isfile(prev["path"]):
+            results[url] = {
+                "url": url,
+                "path": prev["path"],
+                "bytes": os.path.getsize(prev["path"]),
+                "saved": 0,
+                "status": "skipped",
+                "error": None,
+            }
+            continue
+        if not (prev and os.path.isfile(prev["path"])):
+            prev = previous.get(url)
+        todo.append((url, prev))
+
+    if todo:
+        session = make_session(workers)
         try:
-            r = requests.get(url, timeout=timeout, headers=headers)
-            r.raise_for_status()
-
-            # Write
-            with open(out_path, "wb") as f:
-                f.write(r.content)
-
-            man[url] = out_path
-            results.append(
-                {"url": url, "path": out_path, "bytes": len(r.content), "status": "downloaded", "error": None}
-            )
-
-        except requests.RequestException as e:
-            results.append({"url": url, "path": None, "bytes": 0, "status": "failed", "error": str(e)})
+            with ThreadPoolExecutor(max_workers=min(workers, len(todo))) as ex:
+                futures = [ex.submit(fetch_one, session, url, day_dir, prev, timeout, max_bytes) for url, prev in todo]
+                for fut in as_completed(futures):
+                    res, entry = fut.result()
+                    results[res["url"]] = res
+                    if entry:
+                        man[res["url"]] = entry
+        finally:
+            session.close()
 
     save_manifest(day_dir, man)
-    return results
+    return [results[url] for url in urls if url in results]
 
 
 def list_txt_files(day_dir: str):
@@ -138,14 +251,18 @@ def choose_file(files):
 
 
 def print_results(results):
-    ok = [r for r in results if r["status"] in ("downloaded", "skipped")]
+    ok = [r for r in results if r["status"] in ("downloaded", "skipped", "unchanged")]
     bad = [r for r in results if r["status"] == "failed"]
+    unchanged = [r for r in results if r["status"] == "unchanged"]
+    saved = sum(r.get("saved", 0) for r in results)
 
     print(colorize("\nResults:", C.BOLD))
     for r in results:
         status = r["status"]
         if status == "downloaded":
             s = colorize("DOWNLOADED", C.GREEN)
+        elif status == "unchanged":
+            s = colorize("UNCHANGED", C.BLUE)
         elif status == "skipped":
             s = colorize("SKIPPED", C.GRAY)
         else:
@@ -158,10 +275,43 @@ def print_results(results):
         if r["error"]:
             print(f"  {colorize('!!', C.RED)} {r['error']}")
 
-    print(colorize(f"\nSummary: {len(ok)} ok, {len(bad)} failed\n", C.BOLD))
+    print(
+        colorize(
+            f"\nSummary: {len(ok)} ok ({len(unchanged)} unchanged), {len(bad)} failed, "
+            f"{saved} bytes saved by conditional requests\n",
+            C.BOLD,
+        )
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch and scan v2ray configs.")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rescan endpoints that history would skip (dead in each of their last scans)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last interrupted scan of the chosen file, skipping configs it already tested",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="record per-stage timings and failure reasons (scan_results/metrics/)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="also serve Prometheus metrics on 127.0.0.1:PORT/metrics while scanning (0 = any free port)",
+    )
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     URLS = [
         "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_Sub.txt",
         "https://raw.githubusercontent.com/barry-far/V2ray-Config/refs/heads/main/All_Configs_Sub.txt",
@@ -194,7 +344,16 @@ def main():
             print(colorize("No file selected.", C.RED))
             return
         from utils.scanner import scan_file
-        scan_file(picked, base_dir, today_str, day_dir)
+        scan_file(
+            picked,
+            base_dir,
+            today_str,
+            day_dir,
+            force=args.force,
+            resume=args.resume,
+            metrics=args.metrics,
+            metrics_port=args.metrics_port,
+        )
         return
 
     print(colorize("Unknown option.", C.RED))
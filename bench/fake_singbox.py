@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Stand-in for the sing-box binary, for offline benchmarks. Understands what the
+# scanner generates: socks inbounds routed to one outbound each, SIGHUP reloads and
+# the Clash API (/group/<name>/delay, /proxies/<tag>/delay). A proxy outbound
+# "works" when its server accepts and answers like a bench stand-in (TLS handshake
+# or greeting byte); traffic itself then goes straight to the destination.
+# FAKE_SINGBOX_DELAY sets how long it waits before opening its ports.
+import json
+import os
+import signal
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+VERSION = "1.12.20"
+PROXY_TYPES = ("vmess", "vless", "trojan", "shadowsocks")
+KNOWN_TYPES = PROXY_TYPES + ("direct", "selector")
+
+
+class State:
+    def __init__(self, path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            cfg = json.load(f)
+        self.outbounds = {ob["tag"]: ob for ob in cfg.get("outbounds", [])}
+        for ob in self.outbounds.values():
+            if ob.get("type") not in KNOWN_TYPES or (ob["type"] in PROXY_TYPES and not ob.get("server")):
+                sys.stderr.write(f"FATAL: initialize outbound[{ob.get('tag')}]: invalid\n")
+                sys.exit(1)
+        self.inbounds = cfg.get("inbounds", [])
+        self.routes = {r["inbound"]: r["outbound"] for r in cfg.get("route", {}).get("rules", []) if "inbound" in r}
+        self.clash = cfg.get("experimental", {}).get("clash_api", {}).get("external_controller")
+
+
+def hop(ob: dict, timeout: float) -> None:
+    if ob.get("type") not in PROXY_TYPES:
+        return
+    s = socket.create_connection((ob["server"], ob["server_port"]), timeout=timeout)
+    try:
+        tls = ob.get("tls") or {}
+        if tls.get("enabled"):
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            ctx.wrap_socket(s, server_hostname=tls.get("server_name") or None).close()
+        elif not s.recv(1):
+            raise OSError("proxy closed")
+    finally:
+        s.close()
+
+
+def pipe(a: socket.socket, b: socket.socket) -> None:
+    try:
+        while True:
+            data = a.recv(65536)
+            if not data:
+                break
+            b.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (a, b):
+            try:
+                s.close()
+            except OSError:
+                pass
+
+
+def handle_socks(c: socket.socket, ob: dict) -> None:
+    try:
+        c.recv(262)
+        c.sendall(b"\x05\x00")
+        req = c.recv(262)
+        atyp = req[3]
+        if atyp == 1:
+            host, port = socket.inet_ntoa(req[4:8]), int.from_bytes(req[8:10], "big")
+        elif atyp == 3:
+            n = req[4]
+            host, port = req[5 : 5 + n].decode(), int.from_bytes(req[5 + n : 7 + n], "big")
+        else:
+            host, port = socket.inet_ntop(socket.AF_INET6, req[4:20]), int.from_bytes(req[20:22], "big")
+        try:
+            hop(ob, 5)
+            up = socket.create_connection((host, port), timeout=5)
+        except OSError:
+            c.sendall(b"\x05\x01\x00\x01" + b"\0" * 6)
+            c.close()
+            return
+        c.sendall(b"\x05\x00\x00\x01" + b"\0" * 6)
+        threading.Thread(target=pipe, args=(c, up), daemon=True).start()
+        pipe(up, c)
+    except Exception:
+        c.close()
+
+
+def serve(s: socket.socket, state: "State", tag: str) -> None:
+    while True:
+        try:
+            c, _ = s.accept()
+        except OSError:
+            return
+        ob = state.outbounds.get(state.routes.get(tag, ""), {"type": "direct"})
+        threading.Thread(target=handle_socks, args=(c, ob), daemon=True).start()
+
+
+def url_delay(ob: dict, url: str, timeout: float) -> int:
+    start = time.perf_counter()
+    hop(ob, timeout)
+    urllib.request.urlopen(url, timeout=timeout).close()
+    return max(1, int((time.perf_counter() - start) * 1000))
+
+
+def clash_handler(state_ref: list):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            u = urlparse(self.path)
+            qs = parse_qs(u.query)
+            url = qs.get("url", ["http://127.0.0.1/"])[0]
+            timeout = int(qs.get("timeout", ["5000"])[0]) / 1000.0
+            parts = [unquote(p) for p in u.path.strip("/").split("/")]
+            state = state_ref[0]
+
+            if parts == [""]:
+                return self._json(200, {"hello": "clash"})
+            if len(parts) == 3 and parts[0] == "group" and parts[2] == "delay":
+                group = state.outbounds.get(parts[1], {})
+                out = {}
+                lock = threading.Lock()
+
+                def one(tag: str) -> None:
+                    try:
+                        ms = url_delay(state.outbounds[tag], url, timeout)
+                    except Exception:
+                        return
+                    with lock:
+                        out[tag] = ms
+
+                threads = [threading.Thread(target=one, args=(t,)) for t in group.get("outbounds", [])]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                return self._json(200, out)
+            if len(parts) == 3 and parts[0] == "proxies" and parts[2] == "delay":
+                try:
+                    return self._json(200, {"delay": url_delay(state.outbounds[parts[1]], url, timeout)})
+                except Exception:
+                    return self._json(504, {"message": "timeout"})
+            return self._json(404, {"message": "not found"})
+
+        def _json(self, code: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    return Handler
+
+
+def main(argv) -> int:
+    if len(argv) > 1 and argv[1] == "version":
+        print(f"sing-box version {VERSION}\n\nEnvironment: go1.24 linux/amd64")
+        print("Tags: with_gvisor,with_quic,with_utls,with_clash_api\nRevision: bench")
+        return 0
+    if "-c" not in argv:
+        sys.stderr.write("usage: sing-box run -c config.json\n")
+        return 1
+
+    cfg_path = argv[argv.index("-c") + 1]
+    state_ref = [State(cfg_path)]
+    sockets: list = []
+
+    def open_inbounds() -> None:
+        for s in sockets:
+            s.close()
+        sockets.clear()
+        state = state_ref[0]
+        for ib in state.inbounds:
+            s = socket.socket()
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((ib.get("listen", "127.0.0.1"), ib["listen_port"]))
+            s.listen(128)
+            sockets.append(s)
+            threading.Thread(target=serve, args=(s, state, ib.get("tag", "")), daemon=True).start()
+
+    def reload(*_) -> None:
+        try:
+            state_ref[0] = State(cfg_path)
+        except SystemExit:  # like sing-box: log it and keep the old config
+            sys.stderr.write("ERROR reload service: invalid config\n")
+            sys.stderr.flush()
+            return
+        open_inbounds()
+
+    time.sleep(float(os.environ.get("FAKE_SINGBOX_DELAY", "0.1")))
+    open_inbounds()
+    if state_ref[0].clash:
+        host, port = state_ref[0].clash.rsplit(":", 1)
+        api = ThreadingHTTPServer((host, int(port)), clash_handler(state_ref))
+        api.daemon_threads = True
+        threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    while True:
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,262 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.standins import HttpTarget, StandIns, install_fake_singbox  # noqa: E402
+from bench.synth import make_links, write_subscription  # noqa: E402
+
+
+# =========================
+# Helpers
+# =========================
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+def stage_latency(results_tsv: str) -> Dict[str, object]:
+    cols = {"tcp": "tcp_avg_ms", "tls": "tls_ms", "download": "dl_ms"}
+    samples: Dict[str, List[float]] = {name: [] for name in cols}
+    alive = rows = 0
+    with open(results_tsv, encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            rows += 1
+            alive += row["status"] == "ALIVE"
+            for name, col in cols.items():
+                if row.get(col):
+                    samples[name].append(float(row[col]))
+    out: Dict[str, object] = {"scanned": rows, "alive": alive}
+    for name, vals in samples.items():
+        if vals:
+            out[f"{name}_p50_ms"] = round(percentile(vals, 50), 1)
+            out[f"{name}_p99_ms"] = round(percentile(vals, 99), 1)
+    return out
+
+
+def make_standins(args, work: str) -> StandIns:
+    return StandIns(
+        args.listeners,
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        drop_rate=args.drop,
+        refuse_rate=args.refuse,
+        blackhole_rate=args.blackhole,
+        tls_rate=args.tls,
+        cert_dir=work,
+    )
+
+
+# =========================
+# Cases
+# =========================
+# Each case runs in its own process (so peak RSS is its own) and returns its
+# numbers; "eps" is endpoints (or sources) per second.
+def case_parse(args, work: str, mode: str) -> Dict[str, object]:
+    from utils.dedupe import key_of
+    from utils.parse_cache import ParseCache, file_fingerprint
+    from utils.scanner_core import iter_endpoints, iter_endpoints_parallel, iter_file_lines
+
+    path = os.path.join(work, "sub.txt")
+    targets = [("127.0.0.1", 10000 + i, i % 3 == 0) for i in range(args.listeners)]
+    write_subscription(path, make_links(args.endpoints, targets, dup_rate=args.dups), args.format)
+
+    if mode == "cache":
+        cache = ParseCache(os.path.join(work, "cache"))
+        digest, _ = file_fingerprint(path)
+        writer = cache.writer(digest)
+        for ep in iter_endpoints(iter_file_lines(path)):
+            writer.add(replace(ep, key=key_of(ep)))
+        writer.commit()
+
+    start = time.perf_counter()
+    if mode == "serial":
+        n = sum(1 for _ in iter_endpoints(iter_file_lines(path)))
+    elif mode == "parallel":
+        n = sum(1 for _ in iter_endpoints_parallel(path, os.cpu_count() or 1, 0))
+    else:
+        n = sum(1 for _ in cache.load(file_fingerprint(path)[0]))
+    wall = time.perf_counter() - start
+    return {"endpoints": n, "wall_s": round(wall, 3), "eps": round(n / wall, 1), "bytes": os.path.getsize(path)}
+
+
+def case_scan(args, work: str, mode: str) -> Dict[str, object]:
+    import utils.scanner as scanner
+
+    with make_standins(args, work) as standins, HttpTarget(latency=args.target_latency / 1000.0) as target:
+        targets = standins.start()
+        path = os.path.join(work, "sub.txt")
+        write_subscription(path, make_links(args.endpoints, targets, dup_rate=args.dups), args.format)
+
+        scanner.SCAN_ROOT = os.path.join(work, "scan_results")
+        scanner.HISTORY = False
+        scanner.PARSE_CACHE = False
+        # every stand-in lives on 127.0.0.1, so per-destination pacing would only
+        # measure the pacing itself
+        scanner.DEST_HOST_RATE = scanner.DEST_IP_RATE = 0
+        scanner.TCP_TIMEOUT = args.timeout
+        scanner.TLS_TIMEOUT = args.timeout
+        scanner.DOWNLOAD_TIMEOUT = max(args.timeout, 3.0)
+        scanner.DOWNLOAD_TEST_URL = target.url("generate_204")
+        scanner.ENABLE_DOWNLOAD_TEST = mode != "tcp"
+        if mode != "tcp":
+            install_fake_singbox(os.path.join(work, "bin"), args.singbox_delay / 1000.0)
+            scanner.SINGBOX_MODE = mode
+        scanner.console.file = open(os.devnull, "w")
+
+        start = time.perf_counter()
+        scanner.scan_file(path, work, "bench", work, workers=args.workers)
+        wall = time.perf_counter() - start
+
+    out = stage_latency(sorted(glob.glob(os.path.join(work, "scan_results", "results", "*.tsv")))[-1])
+    out.update({"wall_s": round(wall, 3), "eps": round(out["scanned"] / wall, 1), "connections": standins.connections})
+    return out
+
+
+def case_fetch(args, work: str, warm: bool) -> Dict[str, object]:
+    import app
+
+    served = os.path.join(work, "www")
+    os.makedirs(os.path.join(served, "sub"))
+    targets = [("127.0.0.1", 10000 + i, False) for i in range(args.listeners)]
+    per_source = max(1, args.endpoints // args.sources)
+    for i in range(args.sources):
+        links = make_links(per_source, targets, seed=i)
+        write_subscription(os.path.join(served, "sub", f"s{i}.txt"), links, "base64" if i % 2 else "plain")
+
+    day_dir = os.path.join(work, "configs", "bench")
+    os.makedirs(day_dir)
+    with HttpTarget(served, latency=args.target_latency / 1000.0) as target:
+        urls = [target.url(f"sub/s{i}.txt") for i in range(args.sources)]
+        if warm:
+            app.download_all_once_per_day(urls, day_dir, skip_if_downloaded_today=False)
+        start = time.perf_counter()
+        results = app.download_all_once_per_day(urls, day_dir, skip_if_downloaded_today=False)
+        wall = time.perf_counter() - start
+
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    return {
+        "sources": len(urls),
+        "wall_s": round(wall, 3),
+        "eps": round(len(urls) / wall, 1),
+        "bytes": sum(r.get("bytes", 0) for r in results),
+        **statuses,
+    }
+
+
+CASES: Dict[str, Callable] = {
+    "parse_serial": lambda a, w: case_parse(a, w, "serial"),
+    "parse_parallel": lambda a, w: case_parse(a, w, "parallel"),
+    "parse_cache": lambda a, w: case_parse(a, w, "cache"),
+    "scan_tcp": lambda a, w: case_scan(a, w, "tcp"),
+    "scan_batch": lambda a, w: case_scan(a, w, "batch"),
+    "scan_pool": lambda a, w: case_scan(a, w, "pool"),
+    "scan_clash": lambda a, w: case_scan(a, w, "clash"),
+    "fetch_cold": lambda a, w: case_fetch(a, w, False),
+    "fetch_warm": lambda a, w: case_fetch(a, w, True),
+}
+DEFAULT_CASES = ("parse_serial", "parse_cache", "scan_tcp", "scan_batch", "fetch_cold", "fetch_warm")
+
+
+# =========================
+# CLI
+# =========================
+def parse_args(argv=None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Offline scanner benchmarks against local stand-ins.")
+    p.add_argument("cases", nargs="*", help=f"cases to run (default: {' '.join(DEFAULT_CASES)}; 'all' for every case)")
+    p.add_argument("--endpoints", type=int, default=2000, help="share links per input file")
+    p.add_argument("--parse-endpoints", type=int, default=100000, help="share links for the parse_* cases")
+    p.add_argument("--format", choices=("plain", "base64", "mixed"), default="plain")
+    p.add_argument("--dups", type=float, default=0.1, help="fraction of duplicate lines")
+    p.add_argument("--listeners", type=int, default=200, help="proxy stand-ins")
+    p.add_argument("--latency", type=float, default=20.0, help="stand-in answer latency, ms")
+    p.add_argument("--jitter", type=float, default=20.0, help="extra uniform latency, ms")
+    p.add_argument("--drop", type=float, default=0.05, help="fraction of connections reset on accept")
+    p.add_argument("--refuse", type=float, default=0.2, help="fraction of stand-ins that are closed ports")
+    p.add_argument("--blackhole", type=float, default=0.05, help="fraction of stand-ins that drop SYNs")
+    p.add_argument("--tls", type=float, default=0.3, help="fraction of live stand-ins speaking TLS")
+    p.add_argument("--timeout", type=float, default=1.0, help="tcp/tls probe timeout, s")
+    p.add_argument("--singbox-delay", type=float, default=100.0, help="fake sing-box start-up delay, ms")
+    p.add_argument("--target-latency", type=float, default=0.0, help="HTTP target latency, ms")
+    p.add_argument("--workers", type=int, default=16)
+    p.add_argument("--sources", type=int, default=20, help="subscription URLs for the fetch_* cases")
+    p.add_argument("--out", help="append one JSON line per case to this file")
+    p.add_argument("--child", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def run_child(args: argparse.Namespace) -> None:
+    if args.child.startswith("parse_"):
+        args.endpoints = args.parse_endpoints
+    with tempfile.TemporaryDirectory(prefix="bench_") as work:
+        out = CASES[args.child](args, work)
+    out["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print(json.dumps({"case": args.child, **out}))
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.child:
+        run_child(args)
+        return 0
+
+    names = list(CASES) if args.cases == ["all"] else args.cases or list(DEFAULT_CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        print(f"unknown case(s): {', '.join(unknown)}; choose from {', '.join(CASES)}", file=sys.stderr)
+        return 2
+
+    passthrough = [a for a in (argv if argv is not None else sys.argv[1:]) if a not in names and a != "all"]
+    rows = []
+    for name in names:
+        r = subprocess.run(
+            [sys.executable, "-m", "bench.run", "--child", name, *passthrough], cwd=ROOT, capture_output=True, text=True
+        )
+        if r.returncode != 0:
+            print(f"{name}: failed\n{r.stderr.strip()}", file=sys.stderr)
+            continue
+        row = json.loads(r.stdout.strip().splitlines()[-1])
+        rows.append(row)
+        extra = {k: v for k, v in row.items() if k not in ("case", "eps", "wall_s", "peak_rss_mb")}
+        print(
+            f"{name:<15} {row['eps']:>10.1f}/s {row['wall_s']:>8.2f}s {row['peak_rss_mb']:>8.1f} MB  "
+            + " ".join(f"{k}={v}" for k, v in extra.items()),
+            flush=True,
+        )
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"ts": time.time(), **row}) + "\n")
+    return 0 if len(rows) == len(names) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
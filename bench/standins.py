@@ -0,0 +1,252 @@
+import asyncio
+import os
+import random
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+FAKE_SINGBOX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_singbox.py")
+
+
+# =========================
+# Proxy stand-ins
+# =========================
+# `count` local listeners standing in for proxy servers. Each one is, at random:
+#   refuse    - a closed port (connection refused)
+#   blackhole - a listener whose accept queue is full, so SYNs are dropped and
+#               connects time out
+#   ok        - accepts, waits latency + U(0, jitter), then either completes a TLS
+#               handshake (tls listeners) or sends one greeting byte; `drop_rate`
+#               of its connections are reset right after accept instead
+class StandIns:
+    def __init__(
+        self,
+        count: int,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        drop_rate: float = 0.0,
+        refuse_rate: float = 0.0,
+        blackhole_rate: float = 0.0,
+        tls_rate: float = 0.0,
+        seed: int = 1,
+        host: str = "127.0.0.1",
+        cert_dir: Optional[str] = None,
+    ) -> None:
+        self.count = count
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.refuse_rate = refuse_rate
+        self.blackhole_rate = blackhole_rate
+        self.tls_rate = tls_rate
+        self.host = host
+        self.rnd = random.Random(seed)
+        self.connections = 0
+        self.dropped = 0
+        self.targets: List[Tuple[str, int, bool]] = []
+        self.kinds: List[str] = []
+        self._ssl = make_tls_context(cert_dir) if tls_rate > 0 and cert_dir else None
+        self._blackholes: List[socket.socket] = []
+        self._servers: List[asyncio.AbstractServer] = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="standins", daemon=True)
+
+    def start(self) -> List[Tuple[str, int, bool]]:
+        self._thread.start()
+        for _ in range(self.count):
+            r = self.rnd.random()
+            if r < self.refuse_rate:
+                self.targets.append((self.host, self._closed_port(), False))
+                self.kinds.append("refuse")
+            elif r < self.refuse_rate + self.blackhole_rate:
+                self.targets.append((self.host, self._blackhole(), False))
+                self.kinds.append("blackhole")
+            else:
+                tls = self._ssl is not None and self.rnd.random() < self.tls_rate
+                fut = asyncio.run_coroutine_threadsafe(self._listen(tls), self._loop)
+                self.targets.append((self.host, fut.result(), tls))
+                self.kinds.append("tls" if tls else "ok")
+        return self.targets
+
+    def _closed_port(self) -> int:
+        s = socket.socket()
+        s.bind((self.host, 0))
+        port = s.getsockname()[1]
+        s.close()
+        return port
+
+    def _blackhole(self) -> int:
+        s = socket.socket()
+        s.bind((self.host, 0))
+        s.listen(0)
+        port = s.getsockname()[1]
+        fillers = []
+        for _ in range(2):  # backlog 0 still queues one connection on linux
+            c = socket.socket()
+            c.setblocking(False)
+            c.connect_ex((self.host, port))
+            fillers.append(c)
+        time.sleep(0.01)
+        self._blackholes.extend([s, *fillers])
+        return port
+
+    async def _listen(self, tls: bool) -> int:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _Answer(self, tls), self.host, 0, backlog=1024)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    def close(self) -> None:
+        for s in self._blackholes:
+            s.close()
+
+        async def _stop() -> None:
+            for server in self._servers:
+                server.close()
+
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(_stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "StandIns":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# Reading is paused as soon as the connection exists, so a client hello that
+# arrives during the latency wait is still there for the TLS handshake.
+class _Answer(asyncio.Protocol):
+    def __init__(self, owner: StandIns, tls: bool) -> None:
+        self.owner = owner
+        self.tls = tls
+        self.transport: Optional[asyncio.BaseTransport] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        owner = self.owner
+        owner.connections += 1
+        if owner.rnd.random() < owner.drop_rate:
+            owner.dropped += 1
+            transport.abort()
+            return
+        transport.pause_reading()
+        self.task = asyncio.get_running_loop().create_task(self._answer())
+
+    async def _answer(self) -> None:
+        owner = self.owner
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.sleep(owner.latency + owner.rnd.uniform(0, owner.jitter))
+            if self.transport.is_closing():
+                return
+            if self.tls:
+                self.transport = await loop.start_tls(self.transport, self, owner._ssl, server_side=True)
+            else:
+                self.transport.resume_reading()
+                self.transport.write(b"\x00")
+            await asyncio.sleep(30)
+        except Exception:
+            pass
+        finally:
+            if self.transport is not None:
+                self.transport.close()
+
+    def data_received(self, data: bytes) -> None:
+        pass
+
+    def connection_lost(self, exc) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+
+# self-signed certificate for the tls stand-ins; None when openssl is missing
+def make_tls_context(cert_dir: str) -> Optional[ssl.SSLContext]:
+    cert, key = os.path.join(cert_dir, "bench.crt"), os.path.join(cert_dir, "bench.key")
+    if not os.path.exists(cert):
+        if not shutil.which("openssl"):
+            return None
+        r = subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                "-subj", "/CN=bench.local", "-keyout", key, "-out", cert,
+            ],
+            capture_output=True,
+        )
+        if r.returncode != 0:
+            return None
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+# =========================
+# HTTP target
+# =========================
+# Stands in for DOWNLOAD_TEST_URL (/generate_204) and for subscription hosts:
+# everything else is served from `root` with Last-Modified / If-Modified-Since.
+class HttpTarget:
+    def __init__(self, root: Optional[str] = None, latency: float = 0.0, host: str = "127.0.0.1") -> None:
+        latency_s = latency
+
+        class Handler(SimpleHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                if latency_s:
+                    time.sleep(latency_s)
+                if self.path.startswith("/generate_204"):
+                    self.send_response(204)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                super().do_GET()
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, 0), partial(Handler, directory=root or os.getcwd()))
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="http-target", daemon=True)
+        self._thread.start()
+
+    def url(self, path: str) -> str:
+        return self.base_url + "/" + path.lstrip("/")
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "HttpTarget":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# =========================
+# Fake sing-box
+# =========================
+# Puts a `sing-box` shim for fake_singbox.py into bin_dir and prepends it to PATH;
+# `delay` is how long it waits before opening its ports.
+def install_fake_singbox(bin_dir: str, delay: float = 0.1) -> str:
+    os.makedirs(bin_dir, exist_ok=True)
+    shim = os.path.join(bin_dir, "sing-box")
+    with open(shim, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_SINGBOX}" "$@"\n')
+    os.chmod(shim, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_SINGBOX_DELAY"] = str(delay)
+    return shim
@@ -0,0 +1,74 @@
+import base64
+import json
+import random
+import textwrap
+from typing import List, Sequence, Tuple
+
+
+# =========================
+# Share links
+# =========================
+def make_link(scheme: str, host: str, port: int, i: int, tls: bool = False) -> str:
+    if scheme == "vmess":
+        data = {
+            "v": "2",
+            "ps": f"bench-{i}",
+            "add": host,
+            "port": str(port),
+            "id": f"00000000-0000-4000-8000-{i:012d}",
+            "aid": "0",
+            "net": "ws" if i % 2 else "tcp",
+            "path": "/ws",
+            "host": "bench.local",
+            "tls": "tls" if tls else "none",
+        }
+        return "vmess://" + base64.b64encode(json.dumps(data).encode()).decode()
+    if scheme == "vless":
+        security = "tls&sni=bench.local" if tls else "none"
+        return f"vless://00000000-0000-4000-8000-{i:012d}@{host}:{port}?type=tcp&security={security}#bench-{i}"
+    if scheme == "trojan":
+        return f"trojan://pw{i}@{host}:{port}?sni=bench.local#bench-{i}"
+    if scheme == "ss":
+        creds = base64.b64encode(f"aes-128-gcm:pw{i}".encode()).decode()
+        return f"ss://{creds}@{host}:{port}#bench-{i}"
+    raise ValueError(scheme)
+
+
+# Endpoints cycle through the given (host, port, tls) targets; TLS targets get
+# vless/vmess/trojan links, plain ones vmess/vless/ss. `dup_rate` of the lines
+# repeat an earlier endpoint under a new tag.
+def make_links(n: int, targets: Sequence[Tuple[str, int, bool]], dup_rate: float = 0.0, seed: int = 1) -> List[str]:
+    rnd = random.Random(seed)
+    out: List[str] = []
+    for i in range(n):
+        if out and rnd.random() < dup_rate:
+            line = out[rnd.randrange(len(out))]
+            out.append(line.rsplit("#", 1)[0] + f"#dup-{i}" if "#" in line else line)
+            continue
+        host, port, tls = targets[i % len(targets)]
+        scheme = ("vless", "vmess", "trojan")[i % 3] if tls else ("vmess", "vless", "ss")[i % 3]
+        out.append(make_link(scheme, host, port, i, tls))
+    return out
+
+
+# =========================
+# Subscription files
+# =========================
+# "plain": one link per line; "base64": whole body as one wrapped blob;
+# "mixed": alternating plain and encoded sections
+def write_subscription(path: str, links: List[str], fmt: str = "plain") -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "plain":
+            f.write("\n".join(links) + "\n")
+        elif fmt == "base64":
+            blob = base64.b64encode("\n".join(links).encode()).decode()
+            f.write("\n".join(textwrap.wrap(blob, 76)) + "\n")
+        elif fmt == "mixed":
+            for i in range(0, len(links), 1000):
+                part = links[i : i + 1000]
+                if (i // 1000) % 2:
+                    f.write(base64.b64encode("\n".join(part).encode()).decode() + "\n")
+                else:
+                    f.write("# plain section\n" + "\n".join(part) + "\n")
+        else:
+            raise ValueError(fmt)
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+from .probe_async import FD_RESERVE, fd_budget
+
+# =========================
+# Tuning
+# =========================
+MIN_SAMPLES = 20  # completions a window needs before its rates count
+TIMEOUT_SLACK = 0.10  # timeout rate above the running baseline that counts as congestion
+LATENCY_INFLATION = 2.0  # window median / baseline median that counts as congestion
+BACKOFF = 0.7  # multiplicative decrease
+LOAD_HOLD = 1.5  # 1-min load per cpu above which limits stop growing
+LOAD_BACKOFF = 3.0  # ... and above which they shrink
+LOAD_COOLDOWN = 30.0  # the 1-min load average lags; cut for load at most this often
+MAX_LATENCY_SAMPLES = 1024
+
+
+# =========================
+# Adaptive limit
+# =========================
+# An in-flight cap for one stage that the controller moves between lo and hi.
+# Sync stages use acquire()/release() from worker threads; async stages use
+# acquire_async()/release_async() on the probe loop. Both record how long each
+# run took and whether it failed at (about) the stage timeout.
+class AdaptiveLimit:
+    def __init__(self, name: str, initial: int, lo: int, hi: int, timeout: float = 0.0) -> None:
+        self.name = name
+        self.lo = max(1, min(lo, initial))
+        self.hi = max(initial, hi)
+        self.limit = initial
+        self.timeout = timeout
+        self.in_flight = 0
+        self.low_water = self.high_water = initial
+
+        self._cond = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        # current window
+        self._peak = 0
+        self._done = 0
+        self._timeouts = 0
+        self._latency: List[float] = []
+
+        # controller state
+        self.base_timeouts: Optional[float] = None
+        self.base_latency: Optional[float] = None
+        self.prev_done = 0
+        self.cooldown = 0
+
+    @property
+    def fixed(self) -> bool:
+        return self.lo == self.hi
+
+    # ---- sync stages ----
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+            if self.in_flight > self._peak:
+                self._peak = self.in_flight
+
+    def release(self, elapsed: float, ok: bool) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._record(elapsed, ok)
+            self._cond.notify()
+
+    # ---- async stages (probe loop only) ----
+    async def acquire_async(self) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        while self.in_flight >= self.limit:
+            fut = self._loop.create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done():
+                    self._wake()  # woken but cancelled: pass the slot on
+                else:
+                    fut.cancel()
+                raise
+        self.in_flight += 1
+        with self._cond:
+            if self.in_flight > self._peak:
+                self._peak = self.in_flight
+
+    def release_async(self, elapsed: float, ok: bool) -> None:
+        self.in_flight -= 1
+        with self._cond:
+            self._record(elapsed, ok)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def _record(self, elapsed: float, ok: bool) -> None:
+        self._done += 1
+        if ok:
+            if len(self._latency) < MAX_LATENCY_SAMPLES:
+                self._latency.append(elapsed)
+        elif self.timeout and elapsed >= self.timeout * 0.9:
+            self._timeouts += 1
+
+    # ---- controller side ----
+    def set_limit(self, n: int) -> None:
+        self.limit = n
+        self.low_water = min(self.low_water, n)
+        self.high_water = max(self.high_water, n)
+        with self._cond:
+            self._cond.notify_all()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:  # loop already closed
+                pass
+
+    # (completions, timeouts, median success latency, peak in flight) since the last call
+    def take_window(self) -> Tuple[int, int, Optional[float], int]:
+        with self._cond:
+            done, timeouts, lat = self._done, self._timeouts, self._latency
+            peak = max(self._peak, self.in_flight)
+            self._done = self._timeouts = 0
+            self._latency = []
+            self._peak = self.in_flight
+        lat.sort()
+        return done, timeouts, lat[len(lat) // 2] if lat else None, peak
+
+
+# =========================
+# AIMD controller
+# =========================
+# Every `interval` seconds each adaptive limit is either cut by BACKOFF (timeout
+# rate above its baseline, latency well above its baseline without more work
+# getting done, fd headroom gone for socket stages, cpu overloaded) or, when the
+# stage kept all its slots busy and the box has room, raised by a fixed step.
+# After a cut the stage sits out one window so work started under the old limit
+# can drain. on_change(line) reports each change.
+class AimdController:
+    def __init__(
+        self,
+        limits: List[AdaptiveLimit],
+        interval: float = 2.0,
+        on_change: Optional[Callable[[str], None]] = None,
+        socket_stages: Tuple[str, ...] = ("dns", "tcp", "tls"),
+    ) -> None:
+        self.limits = [lim for lim in limits if not lim.fixed]
+        self.interval = interval
+        self.on_change = on_change
+        self.socket_stages = socket_stages
+        self.steps = {lim.name: max(1, lim.limit // 8) for lim in self.limits}
+        self.changes: List[Tuple[float, str, int, int, str]] = []
+        self._started = time.monotonic()
+        self._load_cut = -LOAD_COOLDOWN
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="aimd", daemon=True)
+
+    def start(self) -> "AimdController":
+        if self.limits:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=self.interval + 1)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self) -> None:
+        load = _load_per_cpu()
+        now = time.monotonic()
+        if load is not None and load > LOAD_BACKOFF and now - self._load_cut < LOAD_COOLDOWN:
+            load = LOAD_HOLD + 0.01  # already cut for this load; just hold
+        fd_free = fd_budget(0) if any(lim.name in self.socket_stages for lim in self.limits) else None
+        moved = []
+        for lim in self.limits:
+            old = lim.limit
+            reason = self._adjust(lim, load, fd_free)
+            if lim.limit != old:
+                if reason.startswith("load"):
+                    self._load_cut = now
+                self.changes.append((now - self._started, lim.name, old, lim.limit, reason))
+                moved.append(f"{lim.name} {old}→{lim.limit} ({reason})")
+        if moved and self.on_change is not None:
+            self.on_change(", ".join(moved))
+
+    def _adjust(self, lim: AdaptiveLimit, load: Optional[float], fd_free: Optional[int]) -> str:
+        done, timeouts, latency, peak = lim.take_window()
+        prev_done, lim.prev_done = lim.prev_done, done
+        if lim.cooldown:
+            lim.cooldown -= 1
+            return ""
+
+        reason = ""
+        if done >= MIN_SAMPLES:
+            rate = timeouts / done
+            if lim.base_timeouts is None:
+                lim.base_timeouts = rate
+            if rate > lim.base_timeouts + TIMEOUT_SLACK:
+                reason = f"timeouts {rate:.0%}"
+            else:
+                lim.base_timeouts = lim.base_timeouts * 0.8 + rate * 0.2
+        if latency is not None and done >= MIN_SAMPLES:
+            if lim.base_latency is None or latency < lim.base_latency:
+                lim.base_latency = latency
+            elif latency > lim.base_latency * LATENCY_INFLATION:
+                # queueing that still buys throughput (e.g. fuller sing-box batches) is fine
+                if done <= prev_done * 1.05:
+                    reason = reason or f"latency x{latency / lim.base_latency:.1f}"
+                    lim.base_latency *= 1.25  # let a baseline caught on a lucky window drift up
+            else:
+                lim.base_latency = min(latency, lim.base_latency * 1.02)
+
+        socket_stage = lim.name in self.socket_stages
+        if not reason and socket_stage and fd_free is not None and fd_free < FD_RESERVE:
+            reason = f"{fd_free} fds left"
+        if not reason and load is not None and load > LOAD_BACKOFF:
+            reason = f"load {load:.1f}/cpu"
+
+        if reason:
+            new = max(lim.lo, int(lim.limit * BACKOFF))
+            if new != lim.limit:
+                lim.set_limit(new)
+                lim.cooldown = 1
+            return reason
+
+        step = self.steps[lim.name]
+        if peak < lim.limit or lim.limit >= lim.hi:
+            return ""
+        if load is not None and load > LOAD_HOLD:
+            return ""
+        if socket_stage and fd_free is not None and fd_free < FD_RESERVE + step:
+            return ""
+        lim.set_limit(min(lim.hi, lim.limit + step))
+        return "saturated"
+
+    def summary(self) -> List[str]:
+        return [
+            f"{lim.name} {lim.limit} (range {lim.low_water}–{lim.high_water}, {sum(1 for c in self.changes if c[1] == lim.name)} changes)"
+            for lim in self.limits
+        ]
+
+
+def _load_per_cpu() -> Optional[float]:
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):  # windows
+        return None
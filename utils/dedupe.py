@@ -0,0 +1,78 @@
+import hashlib
+import json
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+from .scanner_core import Endpoint
+from .singbox_tools import build_outbound
+
+
+# =========================
+# Canonical identity
+# =========================
+# Two share lines are the same endpoint when sing-box would build the same outbound
+# from them: scheme, server, port, credential, transport, path and SNI, but not the
+# tag. Lines the builder cannot handle fall back to the line without its fragment.
+def endpoint_key(ep: Endpoint) -> str:
+    try:
+        ob = build_outbound(ep, "")
+        ob.pop("tag", None)
+        ob["server"] = str(ob.get("server", "")).lower()
+        ident = json.dumps(ob, sort_keys=True, separators=(",", ":"))
+    except Exception:
+        ident = ep.scheme + "|" + ep.raw_line.split("#", 1)[0].strip()
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+
+def key_of(ep: Endpoint) -> str:
+    return ep.key or endpoint_key(ep)
+
+
+# =========================
+# Streaming dedupe
+# =========================
+# Dedupes the streaming scan in one pass: only a key -> state entry is kept
+# per distinct endpoint. A duplicate of an endpoint still being probed is attached
+# to its result via finish(); one arriving after the result is known is queued in
+# `late` with that verdict so its line can go straight to the same output file.
+PENDING, ALIVE, DEAD, SKIPPED = 0, 1, 2, 3
+
+
+class StreamDeduper:
+    def __init__(self) -> None:
+        self.merged = 0
+        self.late: List[Tuple[str, bool]] = []
+        self._state: Dict[str, Tuple[int, int]] = {}  # key -> (state, hash of first line)
+        self._aliases: Dict[str, List[str]] = {}
+
+    def admit(self, ep: Endpoint) -> Optional[Endpoint]:
+        key = key_of(ep)
+        entry = self._state.get(key)
+        if entry is None:
+            self._state[key] = (PENDING, hash(ep.raw_line))
+            return ep if ep.key else replace(ep, key=key)
+
+        self.merged += 1
+        state, first = entry
+        if state == SKIPPED or hash(ep.raw_line) == first:
+            return None
+        if state == PENDING:
+            self._aliases.setdefault(key, []).append(ep.raw_line)
+        else:
+            self.late.append((ep.raw_line, state == ALIVE))
+        return None
+
+    def skip(self, ep: Endpoint) -> None:
+        self._state[ep.key] = (SKIPPED, 0)
+        self._aliases.pop(ep.key, None)
+
+    def finish(self, ep: Endpoint, alive: bool) -> Endpoint:
+        self._state[ep.key] = (ALIVE if alive else DEAD, hash(ep.raw_line))
+        lines = self._aliases.pop(ep.key, None)
+        if not lines:
+            return ep
+        return replace(ep, aliases=ep.aliases + tuple(dict.fromkeys(lines)))
+
+    def drain_late(self) -> List[Tuple[str, bool]]:
+        late, self.late = self.late, []
+        return late
@@ -0,0 +1,120 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from .metrics import METRICS
+
+
+# =========================
+# Resolver
+# =========================
+# getaddrinfo does not expose record TTLs, so answers are kept for `ttl` seconds
+# and failures for `negative_ttl`. Concurrent lookups of one host share a single
+# query, and lookups run on a dedicated thread pool so a slow resolver cannot
+# starve the probe loop's default executor. At most `workers` lookups are handed
+# to the pool at once, so `timeout` times the lookup itself, not its wait for a
+# thread; a lookup that times out is not cached and the next caller retries it.
+# hits/misses/failures feed the scan summary and the dns_cache_* metrics counters.
+class Resolver:
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 60.0, timeout: float = 5.0, workers: int = 64) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._cache: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dns")
+        self._workers = workers
+        self._slots: Optional[asyncio.Semaphore] = None  # created on the probe loop
+
+    @staticmethod
+    def is_ip(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host.strip("[]"))
+            return True
+        except ValueError:
+            return False
+
+    # cached addresses (empty tuple for a cached failure), or None when unknown/expired
+    def cached(self, host: str) -> Optional[Tuple[str, ...]]:
+        entry = self._cache.get(host)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def _lookup(self, host: str) -> Tuple[str, ...]:
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            return ()
+        v4 = [i[4][0] for i in infos if i[0] == socket.AF_INET]
+        v6 = [i[4][0] for i in infos if i[0] == socket.AF_INET6]
+        return tuple(dict.fromkeys(v4 + v6))
+
+    def _store(self, host: str, ips: Tuple[str, ...]) -> Optional[str]:
+        ttl = self.ttl if ips else self.negative_ttl
+        self._cache[host] = (time.monotonic() + ttl, ips)
+        if not ips:
+            self.failures += 1
+            METRICS.inc("dns_cache_failures")
+            return None
+        return ips[0]
+
+    async def resolve_async(self, host: str) -> Optional[str]:
+        if self.is_ip(host):
+            return host.strip("[]")
+        ips = self.cached(host)
+        if ips is not None:
+            self._hit()
+            return ips[0] if ips else None
+
+        fut = self._inflight.get(host)
+        if fut is not None:
+            self._hit()
+            return await asyncio.shield(fut)
+
+        self.misses += 1
+        METRICS.inc("dns_cache_misses")
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._inflight[host] = fut
+        try:
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self._workers)
+            await self._slots.acquire()
+            # the slot is held until the thread is done, even past a timeout
+            lookup = loop.run_in_executor(self._pool, self._lookup, host)
+            lookup.add_done_callback(lambda _: self._slots.release())
+            try:
+                ip = self._store(host, await asyncio.wait_for(asyncio.shield(lookup), self.timeout))
+            except asyncio.TimeoutError:
+                self.failures += 1
+                METRICS.inc("dns_cache_failures")
+                ip = None
+            fut.set_result(ip)
+            return ip
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(host, None)
+
+    def _hit(self) -> None:
+        self.hits += 1
+        METRICS.inc("dns_cache_hits")
+
+    # Resolve every unique host concurrently to warm the cache; returns (resolved, failed).
+    async def bulk_resolve(self, hosts: Iterable[str]) -> Tuple[int, int]:
+        names = [h for h in dict.fromkeys(hosts) if not self.is_ip(h)]
+        results = await asyncio.gather(*(self.resolve_async(h) for h in names), return_exceptions=True)
+        ok = sum(1 for r in results if isinstance(r, str))
+        return ok, len(names) - ok
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
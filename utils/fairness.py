@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+from .metrics import METRICS
+
+T = TypeVar("T")
+
+
+# =========================
+# Round-robin interleaving
+# =========================
+# One item per destination per round, each destination's items kept in their
+# original order and destinations in order of first appearance. A list that
+# clusters hundreds of configs on one host then reaches the workers spread out.
+def interleave(items: Iterable[T], dest: Callable[[T], Hashable]) -> List[T]:
+    queues: "OrderedDict[Hashable, Deque[T]]" = OrderedDict()
+    for item in items:
+        q = queues.get(dest(item))
+        if q is None:
+            q = queues[dest(item)] = deque()
+        q.append(item)
+
+    out: List[T] = []
+    active = list(queues.values())
+    while active:
+        for q in active:
+            out.append(q.popleft())
+        active = [q for q in active if q]
+    return out
+
+
+# =========================
+# Token buckets
+# =========================
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+    # takes one token, going into debt if there is none; returns the seconds until
+    # that token is actually earned (0 when it already was)
+    def take(self, now: float) -> float:
+        self.tokens = self.refill(now) - 1.0
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+# Per-host and per-IP buckets. delay() books the next token of both buckets of a
+# destination and says how long to hold the job back for it; it never blocks, so
+# the caller puts the job aside and works on other destinations meanwhile, and a
+# held job runs at its slot without asking again. Jobs passing the same `share`
+# key (one coalesced probe) book once: later ones follow the first one's slot.
+# A rate of 0 turns that side off. Idle buckets are dropped once they have refilled.
+class DestinationLimiter:
+    def __init__(self, host_rate: float, host_burst: float, ip_rate: float, ip_burst: float) -> None:
+        self.host_rate = host_rate
+        self.host_burst = max(1.0, host_burst)
+        self.ip_rate = ip_rate
+        self.ip_burst = max(1.0, ip_burst)
+        self.deferred = 0
+        self._hosts: Dict[str, TokenBucket] = {}
+        self._ips: Dict[str, TokenBucket] = {}
+        self._booked: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.host_rate > 0 or self.ip_rate > 0
+
+    def delay(self, host: str, ip: Optional[str] = None, share: Optional[Hashable] = None) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % 4096 == 0:
+                self._prune(now)
+            if share is not None:
+                at = self._booked.get(share)
+                if at is not None and at > now:
+                    return at - now + 0.001
+            buckets = []
+            if self.host_rate > 0:
+                buckets.append(self._bucket(self._hosts, host, self.host_rate, self.host_burst, now))
+            if self.ip_rate > 0 and ip:
+                buckets.append(self._bucket(self._ips, ip, self.ip_rate, self.ip_burst, now))
+            wait = max([b.take(now) for b in buckets], default=0.0)
+            if wait > 0:
+                self.deferred += 1
+                METRICS.inc("pacing_deferred")
+                if share is not None:
+                    self._booked[share] = now + wait
+            return wait
+
+    @staticmethod
+    def _bucket(table: Dict[str, TokenBucket], key: str, rate: float, burst: float, now: float) -> TokenBucket:
+        b = table.get(key)
+        if b is None:
+            b = table[key] = TokenBucket(rate, burst, now)
+        return b
+
+    def _prune(self, now: float) -> None:
+        for table in (self._hosts, self._ips):
+            for key in [k for k, b in table.items() if b.refill(now) >= b.burst]:
+                del table[key]
+        for key in [k for k, at in self._booked.items() if at <= now]:
+            del self._booked[key]
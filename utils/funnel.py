@@ -0,0 +1,194 @@
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .concurrency import AdaptiveLimit
+from .probe_async import AsyncProbeEngine
+
+
+# =========================
+# Stages
+# =========================
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable[[Any], Any]  # job -> bool (a coroutine when is_async)
+    workers: int
+    is_async: bool = False
+    # bounds for adaptive concurrency (0 = fixed at workers) and the stage's own
+    # timeout, which tells timed-out failures from quick ones
+    min_workers: int = 0
+    max_workers: int = 0
+    timeout: float = 0.0
+    # job -> seconds to hold the job back before this stage (0 = go now)
+    pace: Optional[Callable[[Any], float]] = None
+
+
+# =========================
+# Funnel
+# =========================
+# Moves each job through the stages in order; a job that fails a stage is finalized
+# right there and never reaches the later (more expensive) ones. Sync stages get
+# their own thread pool, async stages run on the probe loop; either way each stage
+# has its own in-flight limit (see concurrency.AimdController for moving it).
+# A paced stage may hold a job back; it then waits on a timer, not in a slot, and
+# enters the stage when the timer fires.
+# submit() returns a Future resolved with finalize(job).
+class Funnel:
+    def __init__(
+        self,
+        stages: List[Stage],
+        finalize: Callable[[Any], Any],
+        probes: Optional[AsyncProbeEngine] = None,
+        max_parked: int = 0,
+    ) -> None:
+        self.stages = stages
+        self.finalize = finalize
+        self.probes = probes
+        self.entered: Dict[str, int] = {s.name: 0 for s in stages}
+        self.passed: Dict[str, int] = {s.name: 0 for s in stages}
+        self.queued: Dict[str, int] = {s.name: 0 for s in stages}  # entered, waiting for a slot
+        self.parked = 0  # held back by a stage's pace, on a timer
+        self.max_parked = max_parked
+        self._lock = threading.Lock()
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self.limits: Dict[str, AdaptiveLimit] = {}
+
+        for s in stages:
+            lim = AdaptiveLimit(s.name, s.workers, s.min_workers or s.workers, s.max_workers or s.workers, s.timeout)
+            self.limits[s.name] = lim
+            if s.is_async:
+                if probes is None:
+                    raise ValueError(f"stage {s.name!r} needs a probe engine")
+            else:
+                self._pools[s.name] = ThreadPoolExecutor(max_workers=lim.hi, thread_name_prefix=f"stage-{s.name}")
+
+    # jobs worth keeping in flight: the sum of the current stage limits, or none
+    # while a stage already has a full limit's worth of jobs waiting for a slot, so
+    # the narrowest stage (usually download) bounds what piles up in front of it.
+    # Parked jobs (up to max_parked) come on top, so pacing one busy destination
+    # does not starve the others of slots
+    @property
+    def window(self) -> int:
+        with self._lock:
+            if any(self.queued[name] > lim.limit for name, lim in self.limits.items()):
+                return 0
+            parked = min(self.parked, self.max_parked)
+        return sum(lim.limit for lim in self.limits.values()) + parked
+
+    def submit(self, job: Any) -> Future:
+        out: Future = Future()
+        self._advance(job, 0, out)
+        return out
+
+    def _advance(self, job: Any, k: int, out: Future) -> None:
+        if out.cancelled():
+            return
+        if k == len(self.stages):
+            self._finish(job, out)
+            return
+
+        stage = self.stages[k]
+        if stage.pace is not None:
+            delay = stage.pace(job)
+            if delay > 0:
+                with self._lock:
+                    self.parked += 1
+                self._later(delay, lambda: self._unpark(job, k, out))
+                return
+        self._enter(job, k, out)
+
+    def _unpark(self, job: Any, k: int, out: Future) -> None:
+        with self._lock:
+            self.parked -= 1
+        self._enter(job, k, out)
+
+    def _enter(self, job: Any, k: int, out: Future) -> None:
+        if out.cancelled():
+            return
+        stage = self.stages[k]
+        with self._lock:
+            self.entered[stage.name] += 1
+            self.queued[stage.name] += 1
+        try:
+            if stage.is_async:
+                fut = self.probes.submit(self._run_async(stage, job))
+            else:
+                fut = self._pools[stage.name].submit(self._run_sync, stage, job)
+        except RuntimeError:  # pools already shut down
+            self._dequeue(stage)
+            out.cancel()
+            return
+        fut.add_done_callback(lambda f: self._after(job, k, out, f))
+
+    def _later(self, delay: float, fn: Callable[[], None]) -> None:
+        if self.probes is not None:
+            self.probes.call_later(delay, fn)
+        else:
+            t = threading.Timer(delay, fn)
+            t.daemon = True
+            t.start()
+
+    async def _run_async(self, stage: Stage, job: Any) -> Any:
+        lim = self.limits[stage.name]
+        try:
+            await lim.acquire_async()
+        finally:
+            self._dequeue(stage)
+        start, res = time.perf_counter(), False
+        try:
+            res = await stage.run(job)
+            return res
+        finally:
+            lim.release_async(time.perf_counter() - start, bool(res))
+
+    def _run_sync(self, stage: Stage, job: Any) -> Any:
+        lim = self.limits[stage.name]
+        lim.acquire()
+        self._dequeue(stage)
+        start, res = time.perf_counter(), False
+        try:
+            res = stage.run(job)
+            return res
+        finally:
+            lim.release(time.perf_counter() - start, bool(res))
+
+    def _dequeue(self, stage: Stage) -> None:
+        with self._lock:
+            self.queued[stage.name] -= 1
+
+    def _after(self, job: Any, k: int, out: Future, f: Future) -> None:
+        try:
+            ok = not f.cancelled() and bool(f.result())
+        except Exception:
+            ok = False
+
+        stage = self.stages[k]
+        if ok:
+            with self._lock:
+                self.passed[stage.name] += 1
+            self._advance(job, k + 1, out)
+        else:
+            job.failed_stage = stage.name
+            self._finish(job, out)
+
+    def _finish(self, job: Any, out: Future) -> None:
+        try:
+            out.set_result(self.finalize(job))
+        except InvalidStateError:
+            pass
+        except Exception as e:
+            try:
+                out.set_exception(e)
+            except InvalidStateError:
+                pass
+
+    def stats(self) -> List[Tuple[str, int, int]]:
+        with self._lock:
+            return [(s.name, self.entered[s.name], self.passed[s.name]) for s in self.stages]
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
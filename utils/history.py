@@ -0,0 +1,120 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .scanner_core import Endpoint
+
+
+# =========================
+# History store
+# =========================
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    key TEXT NOT NULL,
+    ts REAL NOT NULL,
+    alive INTEGER NOT NULL,
+    stage TEXT,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS probes_key_ts ON probes (key, ts);
+CREATE TABLE IF NOT EXISTS endpoints (
+    key TEXT PRIMARY KEY,
+    first_ts REAL NOT NULL,
+    last_ts REAL NOT NULL,
+    last_alive INTEGER NOT NULL,
+    last_ms REAL,
+    fail_streak INTEGER NOT NULL,
+    alive_count INTEGER NOT NULL,
+    scan_count INTEGER NOT NULL
+);
+"""
+
+
+# One row per probe outcome plus a rolling per-endpoint summary, keyed by the
+# canonical endpoint identity. Used from the scan's consumer thread only.
+class HistoryStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def summary(self, keys: Iterable[str]) -> Dict[str, Tuple[int, Optional[float], int, int, int]]:
+        keys = list(keys)
+        out: Dict[str, Tuple[int, Optional[float], int, int, int]] = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i : i + 500]
+            rows = self.db.execute(
+                "SELECT key, last_alive, last_ms, fail_streak, alive_count, scan_count FROM endpoints "
+                f"WHERE key IN ({','.join('?' * len(part))})",
+                part,
+            )
+            for key, last_alive, last_ms, fail_streak, alive_count, scan_count in rows:
+                out[key] = (last_alive, last_ms, fail_streak, alive_count, scan_count)
+        return out
+
+    def record(self, outcomes: Iterable[Tuple[str, bool, Optional[str], Optional[float]]]) -> None:
+        now = time.time()
+        rows = [(key, now, int(alive), stage, ms) for key, alive, stage, ms in outcomes]
+        with self.db:
+            self.db.executemany("INSERT INTO probes (key, ts, alive, stage, latency_ms) VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.executemany(
+                """
+                INSERT INTO endpoints (key, first_ts, last_ts, last_alive, last_ms, fail_streak, alive_count, scan_count)
+                VALUES (?1, ?2, ?2, ?3, ?5, 1 - ?3, ?3, 1)
+                ON CONFLICT(key) DO UPDATE SET
+                    last_ts = ?2,
+                    last_alive = ?3,
+                    last_ms = ?5,
+                    fail_streak = CASE WHEN ?3 THEN 0 ELSE fail_streak + 1 END,
+                    alive_count = alive_count + ?3,
+                    scan_count = scan_count + 1
+                """,
+                rows,
+            )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+# =========================
+# Scheduling
+# =========================
+# Alive-last-time first (fastest first), then never-seen endpoints, then endpoints
+# that failed recently ordered by how often they used to work. Endpoints that failed
+# in each of their last `stale_after` scans are deferred to the end, or dropped when
+# skip is set, unless force is given. Returns those groups (tiers) in that order,
+# each already sorted, how many endpoints had history, and the stale ones.
+def prioritize(
+    endpoints: List[Endpoint],
+    keys: List[str],
+    store: HistoryStore,
+    stale_after: int,
+    skip: bool,
+    force: bool = False,
+) -> Tuple[List[List[Endpoint]], int, List[Endpoint]]:
+    known = store.summary(keys)
+    ranked: List[Tuple[tuple, Endpoint]] = []
+    stale: List[Endpoint] = []
+
+    for pos, (ep, key) in enumerate(zip(endpoints, keys)):
+        h = known.get(key)
+        if h is None:
+            ranked.append(((1, 0.0, pos), ep))
+            continue
+        last_alive, last_ms, fail_streak, alive_count, scan_count = h
+        if not force and stale_after > 0 and fail_streak >= stale_after:
+            stale.append(ep)
+        elif last_alive:
+            ranked.append(((0, last_ms if last_ms is not None else 0.0, pos), ep))
+        else:
+            ranked.append(((2, -alive_count / max(1, scan_count), pos), ep))
+
+    ranked.sort(key=lambda x: x[0])
+    tiers: List[List[Endpoint]] = [[], [], []]
+    for rank, ep in ranked:
+        tiers[rank[0]].append(ep)
+    if not skip:
+        tiers.append(stale)
+    return [t for t in tiers if t], len(known), stale
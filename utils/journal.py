@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+# =========================
+# Scan journal
+# =========================
+# Append-only checkpoint log of one scan, named after the input's content sha1
+# and the scan timestamp. The first line is a JSON header naming the input and
+# the output files; each finished endpoint then adds "+<key>" (alive) or
+# "-<key>" (dead), written only after its result lines reached the output files,
+# and a completed scan ends with "END". A line torn by a crash is ignored when
+# the journal is read back.
+JOURNAL_VERSION = 1
+JOURNAL_END = "END"
+
+
+class ScanJournal:
+    def __init__(self, path: str, header: dict, done: Optional[Dict[str, bool]] = None) -> None:
+        self.path = path
+        self.header = header
+        self.done: Dict[str, bool] = done if done is not None else {}
+        _terminate_torn_line(path)
+        self._f: Optional[TextIO] = open(path, "a", encoding="utf-8")
+        if self._f.tell() == 0:
+            self._f.write(json.dumps(header) + "\n")
+            self._sync()
+
+    @classmethod
+    def create(cls, root: str, digest: str, ts: str, **outputs: str) -> "ScanJournal":
+        os.makedirs(root, exist_ok=True)
+        header = {"journal": JOURNAL_VERSION, "digest": digest, "ts": ts, "started": time.time(), **outputs}
+        return cls(os.path.join(root, f"{digest}_{ts}.log"), header)
+
+    # reopens the newest unfinished journal of this input, or None
+    @classmethod
+    def resume(cls, root: str, digest: str) -> Optional["ScanJournal"]:
+        for path in _journals(root, digest):
+            header, done, finished = read_journal(path)
+            if header is None or header.get("journal") != JOURNAL_VERSION:
+                continue
+            if finished:
+                return None
+            return cls(path, header, done)
+        return None
+
+    def record(self, results: Iterable[Tuple[str, bool]]) -> None:
+        lines: List[str] = []
+        for key, alive in results:
+            self.done[key] = alive
+            lines.append(("+" if alive else "-") + key)
+        if lines and self._f is not None:
+            self._f.write("\n".join(lines) + "\n")
+            self._sync()
+
+    def finish(self) -> None:
+        if self._f is not None:
+            self._f.write(JOURNAL_END + "\n")
+            self._sync()
+
+    def _sync(self) -> None:
+        self._f.flush()
+        try:
+            os.fsync(self._f.fileno())
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+# a line torn by a crash is ended, so the next record does not get glued onto it
+def _terminate_torn_line(path: str) -> None:
+    try:
+        with open(path, "rb+") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+    except FileNotFoundError:
+        pass
+
+
+def _journals(root: str, digest: str) -> List[str]:
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    return [os.path.join(root, n) for n in sorted(names, reverse=True) if n.startswith(digest + "_") and n.endswith(".log")]
+
+
+# drops the other journals of this input once a scan of it has finished
+def prune_journals(root: str, digest: str, keep: str) -> None:
+    for path in _journals(root, digest):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def read_journal(path: str) -> Tuple[Optional[dict], Dict[str, bool], bool]:
+    done: Dict[str, bool] = {}
+    finished = False
+    with open(path, encoding="utf-8", errors="replace") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None, done, False
+        for line in f:
+            if not line.endswith("\n"):
+                break  # torn by a crash
+            line = line.rstrip("\n")
+            if line == JOURNAL_END:
+                finished = True
+            elif line[:1] in ("+", "-") and len(line) > 1:
+                done[line[1:]] = line[0] == "+"
+    return header, done, finished
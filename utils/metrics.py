@@ -0,0 +1,215 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# =========================
+# Metrics
+# =========================
+# Per-stage latency histograms plus failure-reason and plain counters for one
+# scan, exported as Prometheus text and as a JSON summary. Disabled by default:
+# time() then hands out a shared no-op and observe()/fail()/inc() return at once.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n", "lo", "hi")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+        self.lo = float("inf")
+        self.hi = 0.0
+
+    # interpolated within the bucket, then clamped to the observed min/max
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.n:
+            return None
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = max(BUCKETS[i - 1] if i else 0.0, self.lo)
+                hi = min(BUCKETS[i] if i < len(BUCKETS) else self.hi, self.hi)
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.hi
+
+
+class _NoTimer:
+    def __enter__(self) -> "_NoTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: "Metrics", stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hist: Dict[str, _Histogram] = {}
+            self._fail: Dict[Tuple[str, str], int] = {}
+            self._count: Dict[str, int] = {}
+            self.started = time.time()
+
+    def time(self, stage: str):
+        return _Timer(self, stage) if self.enabled else _NO_TIMER
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            h = self._hist.get(stage)
+            if h is None:
+                h = self._hist[stage] = _Histogram()
+            h.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            h.total += seconds
+            h.n += 1
+            if seconds < h.lo:
+                h.lo = seconds
+            if seconds > h.hi:
+                h.hi = seconds
+
+    def fail(self, stage: str, reason: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._fail[(stage, reason)] = self._fail.get((stage, reason), 0) + 1
+
+    def inc(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._count[name] = self._count.get(name, 0) + n
+
+    # =========================
+    # Export
+    # =========================
+    def prometheus(self) -> str:
+        with self._lock:
+            hist = {k: (list(h.counts), h.total, h.n) for k, h in self._hist.items()}
+            fail = dict(self._fail)
+            count = dict(self._count)
+
+        lines: List[str] = [
+            "# HELP scanner_stage_seconds Time spent in each scan stage.",
+            "# TYPE scanner_stage_seconds histogram",
+        ]
+        for stage in sorted(hist):
+            counts, total, n = hist[stage]
+            cum = 0
+            for le, c in zip(BUCKETS + (float("inf"),), counts):
+                cum += c
+                bound = "+Inf" if le == float("inf") else repr(le)
+                lines.append(f'scanner_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cum}')
+            lines.append(f'scanner_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'scanner_stage_seconds_count{{stage="{stage}"}} {n}')
+
+        lines += [
+            "# HELP scanner_failures_total Endpoints and operations that failed, by stage and reason.",
+            "# TYPE scanner_failures_total counter",
+        ]
+        for (stage, reason), n in sorted(fail.items()):
+            lines.append(f'scanner_failures_total{{stage="{stage}",reason="{_label(reason)}"}} {n}')
+
+        for name, n in sorted(count.items()):
+            lines += [f"# TYPE scanner_{name}_total counter", f"scanner_{name}_total {n}"]
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {}
+            for stage, h in sorted(self._hist.items()):
+                row = {"count": h.n, "total_s": round(h.total, 3), "mean_ms": round(h.total / h.n * 1000, 2)}
+                for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+                    row[name] = round(h.quantile(q) * 1000, 2)
+                stages[stage] = row
+            failures: Dict[str, Dict[str, int]] = {}
+            for (stage, reason), n in sorted(self._fail.items()):
+                failures.setdefault(stage, {})[reason] = n
+            return {
+                "started": self.started,
+                "elapsed_s": round(time.time() - self.started, 3),
+                "stages": stages,
+                "failures": failures,
+                "counters": dict(sorted(self._count.items())),
+            }
+
+    def write_prometheus(self, path: str) -> None:
+        _write_atomic(path, self.prometheus())
+
+    def write_summary(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    # serves /metrics on 127.0.0.1:port until stop_server(); port 0 picks one
+    def serve(self, port: int = 0) -> int:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop_server(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, text: str) -> None:
+    fd, tmp = tempfile.mkstemp(prefix=".part_", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+METRICS = Metrics()
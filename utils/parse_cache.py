@@ -0,0 +1,187 @@
+import hashlib
+import marshal
+import os
+import struct
+import tempfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from .scanner_core import PARSER_VERSION, Endpoint, pack_endpoint, unpack_endpoint
+
+
+# =========================
+# Fingerprint
+# =========================
+def file_fingerprint(path: str, block: int = 1 << 20) -> Tuple[str, int]:
+    h = hashlib.sha1()
+    n = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(block), b""):
+            h.update(buf)
+            n += buf.count(b"\n")
+            last = buf[-1:]
+    return h.hexdigest(), n + (last != b"\n")
+
+
+# =========================
+# Parse cache
+# =========================
+# One file per (content sha1, parser version) holding every parsed endpoint of the
+# source in file order, with its canonical key, as a stream of length-prefixed
+# marshal'd records: a header, blocks of CACHE_BLOCK packed endpoints, then an end
+# marker with the count. Replaying it skips decoding and key hashing, and dedupe
+# runs on the precomputed keys. Files are written under a temp name, fsynced and
+# only renamed into place once the whole source has been read; one whose records
+# do not add up to its end marker is dropped on load and the source parsed again.
+CACHE_MAGIC = "scan-parse-cache"
+CACHE_BLOCK = 5000
+_LEN = struct.Struct("<I")
+
+
+def _write_record(f: BinaryIO, obj) -> None:
+    data = marshal.dumps(obj)
+    f.write(_LEN.pack(len(data)))
+    f.write(data)
+
+
+def _read_record(f: BinaryIO):
+    head = f.read(_LEN.size)
+    if len(head) < _LEN.size:
+        raise EOFError("truncated parse cache")
+    (n,) = _LEN.unpack(head)
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError("truncated parse cache")
+    return marshal.loads(data)
+
+
+class CacheWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self._block: List[tuple] = []
+        fd, self._tmp = tempfile.mkstemp(prefix=".part_", suffix=".tmp", dir=os.path.dirname(path))
+        self._f: Optional[BinaryIO] = os.fdopen(fd, "wb")
+        _write_record(self._f, (CACHE_MAGIC, PARSER_VERSION))
+
+    def add(self, ep: Endpoint) -> None:
+        self._block.append(pack_endpoint(ep))
+        self.count += 1
+        if len(self._block) >= CACHE_BLOCK:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._block:
+            _write_record(self._f, self._block)
+            self._block = []
+
+    def commit(self) -> None:
+        if self._f is None:
+            return
+        self._flush()
+        _write_record(self._f, ("end", self.count))
+        self._f.flush()
+        os.fsync(self._f.fileno())  # the rename must not land before the data
+        self._f.close()
+        self._f = None
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+# Walks the record lengths after the header without decoding the blocks: the file
+# must end on a record boundary with ("end", count), and hold exactly the number of
+# blocks that count needs. Leaves f positioned at the first block.
+def _complete(f: BinaryIO) -> bool:
+    start = f.tell()
+    size = os.fstat(f.fileno()).st_size
+    pos, last, records = start, -1, 0
+    while pos < size:
+        head = f.read(_LEN.size)
+        if len(head) < _LEN.size:
+            return False
+        last, records = pos, records + 1
+        pos += _LEN.size + _LEN.unpack(head)[0]
+        f.seek(pos)
+    if pos != size or last < 0:
+        return False
+    f.seek(last)
+    try:
+        end = _read_record(f)
+    except (EOFError, ValueError, TypeError):
+        return False
+    if not (isinstance(end, tuple) and len(end) == 2 and end[0] == "end" and isinstance(end[1], int)):
+        return False
+    f.seek(start)
+    return records - 1 == -(-end[1] // CACHE_BLOCK)
+
+
+class ParseCache:
+    def __init__(self, root: str, keep: int = 20) -> None:
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.p{PARSER_VERSION}.bin")
+
+    # endpoints in file order, or None when there is no usable entry
+    def load(self, digest: str) -> Optional[Iterator[Endpoint]]:
+        path = self.path_for(digest)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            header = _read_record(f)
+        except (EOFError, ValueError, TypeError):
+            header = None
+        if header != (CACHE_MAGIC, PARSER_VERSION):
+            f.close()
+            return None
+        if not _complete(f):
+            f.close()
+            try:
+                os.remove(path)  # torn or damaged: parse the source again
+            except OSError:
+                pass
+            return None
+        os.utime(path)
+        return self._replay(f)
+
+    def _replay(self, f: BinaryIO) -> Iterator[Endpoint]:
+        with f:
+            while True:
+                block = _read_record(f)
+                if isinstance(block, tuple):  # end marker
+                    return
+                for t in block:
+                    yield unpack_endpoint(t)
+
+    def writer(self, digest: str) -> CacheWriter:
+        self.prune()
+        return CacheWriter(self.path_for(digest))
+
+    # least recently used entries beyond `keep` are dropped
+    def prune(self) -> None:
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.keep :]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
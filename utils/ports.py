@@ -0,0 +1,73 @@
+import os
+import socket
+import threading
+from typing import Dict, List
+
+
+# =========================
+# Port leases
+# =========================
+class PortLeaser:
+    def __init__(self, start: int = 20000, end: int = 35000, host: str = "127.0.0.1") -> None:
+        self.start = start
+        self.end = end
+        self.host = host
+        self.leases = 0
+        self.retries = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._leased: set = set()
+        # start at a pid-dependent offset so two scanners on one box do not walk the same ports
+        self._next = start + (os.getpid() * 7919) % (end - start)
+
+    def _is_free(self, port: int) -> bool:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind((self.host, port))
+            return True
+        except OSError:
+            return False
+        finally:
+            s.close()
+
+    def lease(self) -> int:
+        with self._lock:
+            span = self.end - self.start
+            for _ in range(span):
+                port = self._next
+                self._next = self.start + (self._next + 1 - self.start) % span
+                if port in self._leased:
+                    continue
+                if not self._is_free(port):
+                    self.retries += 1
+                    continue
+                self._leased.add(port)
+                self.leases += 1
+                self.peak = max(self.peak, len(self._leased))
+                return port
+        raise RuntimeError(f"no free port in {self.start}-{self.end}")
+
+    def lease_many(self, n: int) -> List[int]:
+        ports: List[int] = []
+        try:
+            for _ in range(n):
+                ports.append(self.lease())
+        except RuntimeError:
+            self.release_many(ports)
+            raise
+        return ports
+
+    def release(self, port: int) -> None:
+        with self._lock:
+            self._leased.discard(port)
+
+    def release_many(self, ports: List[int]) -> None:
+        with self._lock:
+            self._leased.difference_update(ports)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leases": self.leases, "retries": self.retries, "in_use": len(self._leased), "peak": self.peak}
+
+
+PORTS = PortLeaser()
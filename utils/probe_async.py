@@ -0,0 +1,245 @@
+import asyncio
+import os
+import ssl
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+# =========================
+# fd budget
+# =========================
+FD_RESERVE = 128
+
+
+def fd_budget(reserve: int = FD_RESERVE) -> int:
+    if resource is None:
+        return 512  # select() limit on windows
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+
+    try:
+        in_use = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        in_use = 0
+    return max(1, soft - in_use - reserve)
+
+
+# =========================
+# Async probes
+# =========================
+async def tcp_connect_ms_async(host: str, port: int, timeout: float) -> float:
+    start = time.perf_counter()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    ms = (time.perf_counter() - start) * 1000.0
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return ms
+
+
+async def measure_tcp_async(
+    host: str, port: int, tries: int, timeout: float, sem: Optional[asyncio.Semaphore] = None
+) -> Tuple[Optional[float], int]:
+    times: List[float] = []
+    fails = 0
+    for _ in range(tries):
+        try:
+            if sem is None:
+                times.append(await tcp_connect_ms_async(host, port, timeout))
+            else:
+                async with sem:
+                    times.append(await tcp_connect_ms_async(host, port, timeout))
+        except Exception:
+            fails += 1
+    if not times:
+        return None, fails
+    return statistics.mean(times), fails
+
+
+async def tls_handshake_ms_async(
+    host: str, port: int, sni: str, timeout: float, sem: Optional[asyncio.Semaphore] = None
+) -> Optional[float]:
+    try:
+        if sem is None:
+            return await _tls_handshake(host, port, sni, timeout)
+        async with sem:
+            return await _tls_handshake(host, port, sni, timeout)
+    except Exception:
+        return None
+
+
+# Built once: certificates are not verified, so there is no CA store to load
+# (create_default_context spends tens of ms doing that on every call).
+@lru_cache(maxsize=None)
+def insecure_tls_context() -> ssl.SSLContext:
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+async def _tls_handshake(host: str, port: int, sni: str, timeout: float) -> float:
+    start = time.perf_counter()
+    _, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=insecure_tls_context(), server_hostname=sni or host), timeout
+    )
+    ms = (time.perf_counter() - start) * 1000.0
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return ms
+
+
+class _UdpReply(asyncio.DatagramProtocol):
+    def __init__(self, fut: asyncio.Future) -> None:
+        self.fut = fut
+
+    def datagram_received(self, data, addr) -> None:
+        if not self.fut.done():
+            self.fut.set_result("reply")
+
+    def error_received(self, exc) -> None:
+        if not self.fut.done():
+            self.fut.set_result("oserror")
+
+
+async def measure_udp_async(
+    host: str, port: int, timeout: float, sem: Optional[asyncio.Semaphore] = None
+) -> Tuple[Optional[float], str]:
+    if sem is not None:
+        async with sem:
+            return await measure_udp_async(host, port, timeout)
+
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    try:
+        transport, _ = await asyncio.wait_for(
+            loop.create_datagram_endpoint(lambda: _UdpReply(fut), remote_addr=(host, port)), timeout
+        )
+    except Exception:
+        return None, "oserror"
+    try:
+        start = time.perf_counter()
+        transport.sendto(b"\x00")
+        try:
+            status = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None, "no_reply"
+        if status != "reply":
+            return None, status
+        return (time.perf_counter() - start) * 1000.0, "reply"
+    finally:
+        transport.close()
+
+
+# =========================
+# Coalescing
+# =========================
+# Shares one probe between every caller asking about the same target (e.g.
+# ("tcp", ip, port)) within `window` seconds; window <= 0 keeps results for the
+# whole scan. Must be used from the probe loop.
+class ProbeCoalescer:
+    def __init__(self, window: float = 300.0) -> None:
+        self.window = window
+        self.probed = 0
+        self.shared = 0
+        self._entries: Dict[Hashable, Tuple[float, asyncio.Future]] = {}
+
+    def _prune(self, now: float) -> None:
+        if self.window <= 0 or len(self._entries) < 4096 or self.probed % 1024:
+            return
+        for key in [k for k, (t, fut) in self._entries.items() if fut.done() and now - t >= self.window]:
+            del self._entries[key]
+
+    # whether run(key, ...) would share an existing probe right now
+    def covers(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and (self.window <= 0 or time.monotonic() - entry[0] < self.window)
+
+    async def run(self, key: Hashable, probe: Callable[[], Awaitable[Any]]) -> Any:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and (self.window <= 0 or now - entry[0] < self.window):
+            self.shared += 1
+            return await asyncio.shield(entry[1])
+
+        task = asyncio.ensure_future(probe())
+        self._entries[key] = (now, task)
+        self.probed += 1
+        self._prune(now)
+        return await asyncio.shield(task)
+
+
+# =========================
+# Engine
+# =========================
+# Runs an event loop on a background thread so thread-based callers can hand it
+# thousands of probes at once; in-flight sockets are capped by max_in_flight and
+# by the process fd limit.
+class AsyncProbeEngine:
+    def __init__(self, max_in_flight: int = 1000) -> None:
+        self.limit = max(1, min(max_in_flight, fd_budget()))
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="probe-loop", daemon=True)
+        self._thread.start()
+        self.sem = self.semaphore(self.limit)
+
+    async def _make_sem(self, n: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(n)
+
+    # semaphore bound to the probe loop
+    def semaphore(self, n: int) -> asyncio.Semaphore:
+        return self._call(self._make_sem(max(1, n)))
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # runs fn on the probe loop after delay seconds
+    def call_later(self, delay: float, fn: Callable[[], Any]) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._loop.call_later, delay, fn)
+        except RuntimeError:  # loop already closed
+            pass
+
+    async def _cancel_pending(self) -> None:
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        self._call(self._cancel_pending())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+    def __enter__(self) -> "AsyncProbeEngine":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
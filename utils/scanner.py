@@ -1,8 +1,11 @@
 import os
 import signal
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from dataclasses import replace
 from datetime import datetime
-from typing import List, Optional, Tuple
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 from rich.console import Console
 from rich.panel import Panel
@@ -16,15 +19,33 @@ from rich.progress import (
 )
 from rich.table import Table
 
-from .scanner_core import Endpoint, ScanResult, extract_endpoints, measure_tcp, measure_udp
-from .singbox_tools import has_singbox, real_download_test
+from .ports import PORTS
+from .dedupe import StreamDeduper, key_of
+from .dns_cache import Resolver
+from .funnel import Funnel, Stage
+from .concurrency import AimdController
+from .fairness import DestinationLimiter, interleave
+from .history import HistoryStore, prioritize
+from .journal import ScanJournal, prune_journals
+from .metrics import METRICS
+from .parse_cache import ParseCache, file_fingerprint
+from .probe_async import (
+    AsyncProbeEngine,
+    ProbeCoalescer,
+    measure_tcp_async,
+    measure_udp_async,
+    tls_handshake_ms_async,
+)
+from .scanner_core import Endpoint, ScanResult, count_lines, iter_endpoints_parallel
+from .singbox_tools import has_singbox, make_download_engine, real_download_test, singbox_info, tls_target
 
 
 # ============================================================
 # Configuration
 # ============================================================
 DEFAULT_WORKERS = 16
-CHUNK_SIZE = 20
+CHUNK_SIZE = 20  # results per chunk report/save
+REPORT_INTERVAL = 10.0  # seconds; flush a partial chunk after this long
 
 TCP_TRIES = 2
 TCP_TIMEOUT = 3.0
@@ -32,10 +53,109 @@ TCP_TIMEOUT = 3.0
 ENABLE_UDP = False
 UDP_TIMEOUT = 2.0
 
+TLS_TIMEOUT = 4.0
+
+DNS_TTL = 300.0
+DNS_NEGATIVE_TTL = 60.0
+DNS_TIMEOUT = 5.0
+DNS_CONCURRENCY = 64
+
+# Probing funnel: each endpoint runs these stages in order and stops at the first
+# one it fails, so TCP-dead endpoints never cost a TLS handshake or a sing-box test.
+# "dns" answers from a cache warmed by a bulk pre-resolve and hands the IP to the
+# later probes; "tls" only gates endpoints that use TLS; "download" is dropped when
+# sing-box is missing or ENABLE_DOWNLOAD_TEST is off. dns/tcp/tls run on one asyncio
+# loop capped at PROBE_MAX_IN_FLIGHT sockets, download runs on its own thread pool.
+SCAN_STAGES = ("dns", "tcp", "tls", "download")
+STAGE_WORKERS = {"dns": DNS_CONCURRENCY, "tcp": 1000, "tls": 256, "download": DEFAULT_WORKERS}
+PROBE_MAX_IN_FLIGHT = 1000
+# configs that only differ by credential share one tcp/udp/tls probe per (ip, port)
+# within this many seconds (0 = once per scan, which keeps every ip:port verdict
+# for the whole run); the download test stays per-config
+PROBE_COALESCE = True
+PROBE_COALESCE_WINDOW = 0.0
+PROBE_CHUNK_SIZE = 500  # chunk size for scans without the download stage
+
+# AIMD concurrency: every CONCURRENCY_INTERVAL seconds each stage in ADAPTIVE_STAGES
+# moves its in-flight limit within [workers / CONCURRENCY_MIN_DIV, workers *
+# CONCURRENCY_MAX_MULT] (async stages also stay under PROBE_MAX_IN_FLIGHT): cut on
+# timeout storms, latency inflation, low fd headroom or cpu overload, raised step
+# by step while all its slots stay busy. Changes are logged as they happen.
+ADAPTIVE_CONCURRENCY = True
+ADAPTIVE_STAGES = ("tcp", "tls", "download")
+CONCURRENCY_INTERVAL = 2.0
+CONCURRENCY_MIN_DIV = 8
+CONCURRENCY_MAX_MULT = 4
+
+# Per-destination pacing: new connections to one host name, and to one IP, go
+# through token buckets (per-second rate, burst; rate 0 = off). A job over budget
+# waits on a timer rather than in a worker slot, so the workers move on to other
+# destinations; held jobs (up to SCAN_LOOKAHEAD) do not count against the
+# in-flight window, so they do not crowd out other destinations. The download test
+# is not paced again. DEST_INTERLEAVE also feeds each SCAN_LOOKAHEAD block round-robin
+# by host (within each history tier), so a list clustered on a few hosts does not
+# hit them all at once.
+DEST_HOST_RATE = 10.0
+DEST_HOST_BURST = 20
+DEST_IP_RATE = 20.0
+DEST_IP_BURST = 40
+DEST_INTERLEAVE = True
+
 ENABLE_DOWNLOAD_TEST = True
 DOWNLOAD_TEST_URL = "https://www.google.com/generate_204"
 DOWNLOAD_TIMEOUT = 12.0
 SINGBOX_BIN = "sing-box"
+SINGBOX_READY_TIMEOUT = 5.0
+
+# "batch": many endpoints share one sing-box process
+# "pool":  DEFAULT_WORKERS long-lived sing-box processes, outbound swapped by config reload
+# "clash": many endpoints share one sing-box process, delays measured by sing-box's Clash API
+#          (needs a build with the with_clash_api tag; "batch" is used otherwise)
+# "single": one sing-box process per endpoint
+SINGBOX_MODE = "batch"
+BATCH_SIZE = DEFAULT_WORKERS
+BATCH_LINGER = 0.5
+POOL_MAX_TESTS = 50
+
+# collapse share lines that only differ by tag/format; results fan out to every copy.
+# Keeps one key per distinct endpoint for the whole scan (see SCAN_LOOKAHEAD)
+DEDUPE = True
+
+# endpoint history (SCAN_ROOT/history.sqlite3) schedules last-known-alive endpoints
+# first; endpoints dead in each of their last HISTORY_STALE_AFTER scans are skipped
+# (or only deferred to the end with HISTORY_SKIP_STALE = False) unless force=True
+HISTORY = True
+HISTORY_STALE_AFTER = 3
+HISTORY_SKIP_STALE = True
+
+# the input file is parsed lazily; history ordering and DNS pre-resolution work on
+# blocks of this many endpoints, and the in-flight window stops growing while any
+# stage has a full limit's worth of jobs waiting for it. Endpoints themselves are
+# not held past their result, but a few per-endpoint records still grow with the
+# input (O(distinct endpoints), not bounded): the DEDUPE key table (~200 bytes per
+# distinct endpoint), the resume journal's done map and, on resume, one hash per
+# saved output line, and the PROBE_COALESCE table when PROBE_COALESCE_WINDOW is 0
+# (one entry per ip:port)
+SCAN_LOOKAHEAD = 5000
+# files of at least PARSE_PARALLEL_MIN_BYTES are parsed by PARSE_WORKERS processes
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_PARALLEL_MIN_BYTES = 16 << 20
+# parsed endpoints of each input file are cached under SCAN_ROOT/parse_cache, keyed
+# by content hash and parser version; a rescan of the same file skips parsing
+PARSE_CACHE = True
+PARSE_CACHE_KEEP = 20
+
+# per-stage timings and failure reasons, written to SCAN_ROOT/metrics/ as Prometheus
+# text (refreshed with every chunk) and a JSON summary at the end of the run;
+# METRICS_PORT also serves them on 127.0.0.1:<port>/metrics while scanning (0 = any
+# free port, None = no endpoint)
+METRICS_ENABLED = False
+METRICS_PORT: Optional[int] = None
+
+# every scan keeps an append-only journal of finished endpoints under
+# SCAN_ROOT/journal, so scan_file(resume=True) can pick an interrupted scan of the
+# same input back up: done endpoints are skipped and the same output files continued
+JOURNAL = True
 
 SCAN_ROOT = "scan_results"
 
@@ -88,7 +208,7 @@ def status_cell(r: ScanResult) -> str:
 
 
 def dl_cell(r: ScanResult) -> str:
-    if not (ENABLE_DOWNLOAD_TEST and has_singbox(SINGBOX_BIN)):
+    if not download_active():
         return "[dim]skipped[/]"
     if r.dl_ok:
         hs = f" ({r.http_status})" if r.http_status is not None else ""
@@ -102,17 +222,55 @@ def dl_cell(r: ScanResult) -> str:
 def init_output_files(results_path: str, whitelist_path: str, failed_path: str) -> None:
 
     with open(results_path, "w", encoding="utf-8") as out:
-        out.write("status\tscheme\tnetwork\thost\tport\ttcp_avg_ms\ttcp_fails\tudp\tudp_ms\tdl\tdl_ms\thttp\n")
+        out.write(
+            "status\tscheme\tnetwork\thost\tport\ttcp_avg_ms\ttcp_fails\tudp\tudp_ms\tdl\tdl_ms\thttp\ttls_ms\tfailed_stage\tline\n"
+        )
 
     open(whitelist_path, "w", encoding="utf-8").close()
     open(failed_path, "w", encoding="utf-8").close()
 
 
+# Continues the outputs of an interrupted scan: missing files are recreated, a line
+# torn by a crash is terminated, and the hashes of the config lines already saved
+# are returned so duplicates of finished endpoints are not written twice.
+def reopen_output_files(results_path: str, whitelist_path: str, failed_path: str) -> Set[int]:
+    if not os.path.exists(results_path):
+        with open(results_path, "w", encoding="utf-8") as out:
+            out.write(
+                "status\tscheme\tnetwork\thost\tport\ttcp_avg_ms\ttcp_fails\tudp\tudp_ms\tdl\tdl_ms\thttp\ttls_ms\tfailed_stage\tline\n"
+            )
+
+    written: Set[int] = set()
+    for path in (results_path, whitelist_path, failed_path):
+        if not os.path.exists(path):
+            open(path, "w", encoding="utf-8").close()
+            continue
+        with open(path, "rb+") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        if path != results_path:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                written.update(hash(line.rstrip("\n")) for line in f)
+    return written
+
+
 def append_chunk_outputs(
     results_path: str,
     whitelist_path: str,
     failed_path: str,
     chunk_results: List[ScanResult],
+) -> Tuple[int, int]:
+    with METRICS.time("write_outputs"):
+        return _append_chunk_outputs(results_path, whitelist_path, failed_path, chunk_results)
+
+
+def _append_chunk_outputs(
+    results_path: str,
+    whitelist_path: str,
+    failed_path: str,
+    chunk_results: List[ScanResult],
 ) -> Tuple[int, int]:
     alive_lines: List[str] = []
     failed_lines: List[str] = []
@@ -123,13 +281,31 @@ def append_chunk_outputs(
                 f"{'ALIVE' if r.alive else 'DEAD'}\t{r.ep.scheme}\t{r.ep.network}\t{r.ep.host}\t{r.ep.port}\t"
                 f"{r.tcp_avg_ms if r.tcp_avg_ms is not None else ''}\t{r.tcp_fails}\t"
                 f"{r.udp_status}\t{r.udp_avg_ms if r.udp_avg_ms is not None else ''}\t"
-                f"{r.dl_reason}\t{r.dl_ms if r.dl_ms is not None else ''}\t{r.http_status if r.http_status is not None else ''}\n"
+                f"{r.dl_reason}\t{r.dl_ms if r.dl_ms is not None else ''}\t{r.http_status if r.http_status is not None else ''}\t"
+                f"{r.tls_ms if r.tls_ms is not None else ''}\t{r.failed_stage or ''}\t{r.ep.line_no or ''}\n"
             )
 
             if r.alive:
                 alive_lines.append(r.ep.raw_line)
+                alive_lines.extend(r.ep.aliases)
             else:
                 failed_lines.append(r.ep.raw_line)
+                failed_lines.extend(r.ep.aliases)
+
+    if alive_lines:
+        with open(whitelist_path, "a", encoding="utf-8") as wf:
+            wf.write("\n".join(alive_lines) + "\n")
+
+    if failed_lines:
+        with open(failed_path, "a", encoding="utf-8") as ff:
+            ff.write("\n".join(failed_lines) + "\n")
+
+    return len(alive_lines), len(failed_lines)
+
+
+def append_alias_lines(whitelist_path: str, failed_path: str, lines: List[Tuple[str, bool]]) -> Tuple[int, int]:
+    alive_lines = [ln for ln, alive in lines if alive]
+    failed_lines = [ln for ln, alive in lines if not alive]
 
     if alive_lines:
         with open(whitelist_path, "a", encoding="utf-8") as wf:
@@ -143,28 +319,54 @@ def append_chunk_outputs(
 
 
 # ============================================================
-# Single scan
+# Scan jobs
 # ============================================================
-def scan_one(idx: int, total: int, ep: Endpoint) -> ScanResult:
-    tcp_avg, tcp_fails = measure_tcp(ep.host, ep.port, tries=TCP_TRIES, timeout=TCP_TIMEOUT)
+def download_active() -> bool:
+    return ENABLE_DOWNLOAD_TEST and has_singbox(SINGBOX_BIN)
+
+
+class ScanJob:
+    __slots__ = ("idx", "total", "ep", "ip", "tcp", "udp", "tls_ms", "dl", "failed_stage")
+
+    def __init__(self, idx: int, total: int, ep: Endpoint) -> None:
+        self.idx = idx
+        self.total = total
+        self.ep = ep
+        self.ip: Optional[str] = None
+        self.tcp: Tuple[Optional[float], int] = (None, 0)
+        self.udp: Tuple[Optional[float], str] = (None, "off")
+        self.tls_ms: Optional[float] = None
+        self.dl: Tuple[bool, str, Optional[float], Optional[int]] = (False, "skipped", None, None)
+        self.failed_stage: Optional[str] = None
+
+
+# failure reason recorded for endpoints dropped by a probe stage; the download
+# stage reports its own (timeout, refused, bad_status, ...)
+STAGE_FAIL_REASONS = {"dns": "unresolved", "tcp": "unreachable", "tls": "handshake"}
 
-    if ENABLE_UDP:
-        udp_avg, udp_status = measure_udp(ep.host, ep.port, timeout=UDP_TIMEOUT)
+
+def make_result(job: ScanJob) -> ScanResult:
+    tcp_avg, tcp_fails = job.tcp
+    udp_avg, udp_status = job.udp
+    dl_ok, dl_reason, dl_ms, http_status = job.dl
+
+    if download_active():
+        alive = dl_ok
+        if job.failed_stage and job.failed_stage != "download":
+            dl_reason = f"{job.failed_stage}_fail"
     else:
-        udp_avg, udp_status = None, "off"
-
-    dl_ok, dl_reason, dl_ms, http_status = real_download_test(
-        ep,
-        enabled=ENABLE_DOWNLOAD_TEST,
-        bin_name=SINGBOX_BIN,
-        test_url=DOWNLOAD_TEST_URL,
-        timeout=DOWNLOAD_TIMEOUT,
-    )
+        alive = job.failed_stage is None
+
+    if METRICS.enabled:
+        METRICS.inc("endpoints_alive" if alive else "endpoints_dead")
+        if job.failed_stage:
+            reason = dl_reason if job.failed_stage == "download" else STAGE_FAIL_REASONS.get(job.failed_stage, "failed")
+            METRICS.fail(job.failed_stage, reason)
 
     return ScanResult(
-        idx=idx,
-        total=total,
-        ep=ep,
+        idx=job.idx,
+        total=job.total,
+        ep=job.ep,
         tcp_avg_ms=tcp_avg,
         tcp_fails=tcp_fails,
         udp_avg_ms=udp_avg,
@@ -173,25 +375,187 @@ def scan_one(idx: int, total: int, ep: Endpoint) -> ScanResult:
         dl_reason=dl_reason,
         dl_ms=dl_ms,
         http_status=http_status,
+        alive=alive,
+        tls_ms=job.tls_ms,
+        failed_stage=job.failed_stage,
     )
 
 
+# ============================================================
+# Stages
+# ============================================================
+def make_resolver() -> Resolver:
+    return Resolver(DNS_TTL, DNS_NEGATIVE_TTL, DNS_TIMEOUT, DNS_CONCURRENCY)
+
+
+def build_stages(
+    engine,
+    probes: AsyncProbeEngine,
+    workers: Optional[Dict[str, int]] = None,
+    resolver: Optional[Resolver] = None,
+    coalescer: Optional[ProbeCoalescer] = None,
+    limiter: Optional[DestinationLimiter] = None,
+) -> List[Stage]:
+    workers = {**STAGE_WORKERS, **(workers or {})}
+
+    async def shared(key, probe):
+        if coalescer is None:
+            return await probe()
+        return await coalescer.run(key, probe)
+
+    def tcp_key(job: ScanJob) -> tuple:
+        return ("tcp", job.ip or job.ep.host, job.ep.port)
+
+    def tls_key(job: ScanJob) -> Optional[tuple]:
+        sni = tls_target(job.ep)
+        if sni is None:
+            return None
+        return ("tls", job.ip or job.ep.host, job.ep.port, sni or job.ep.host)
+
+    # the tcp and tls probes take a token from the endpoint's host and IP buckets
+    # first, unless the probe is answered by the coalescer or skipped; configs sharing
+    # one coalesced probe share its token. The download test is not charged again:
+    # it only runs for endpoints whose probes just got through
+    def paced(probe_key: Callable[[ScanJob], Optional[tuple]]) -> Optional[Callable[[ScanJob], float]]:
+        if limiter is None or not limiter.enabled:
+            return None
+
+        def pace(job: ScanJob) -> float:
+            key = probe_key(job)
+            if key is None or (coalescer is not None and coalescer.covers(key)):
+                return 0.0
+            return limiter.delay(job.ep.host, job.ip, key if coalescer is not None else None)
+
+        return pace
+
+    async def dns_stage(job: ScanJob) -> bool:
+        if resolver is None:
+            return True
+        job.ip = await resolver.resolve_async(job.ep.host)
+        return job.ip is not None
+
+    async def tcp_stage(job: ScanJob) -> bool:
+        key = tcp_key(job)
+        _, addr, port = key
+        job.tcp = await shared(key, lambda: measure_tcp_async(addr, port, TCP_TRIES, TCP_TIMEOUT, probes.sem))
+        if ENABLE_UDP:
+            job.udp = await shared(("udp", addr, port), lambda: measure_udp_async(addr, port, UDP_TIMEOUT, probes.sem))
+        return job.tcp[0] is not None
+
+    async def tls_stage(job: ScanJob) -> bool:
+        key = tls_key(job)
+        if key is None:
+            return True
+        _, addr, port, sni = key
+        job.tls_ms = await shared(key, lambda: tls_handshake_ms_async(addr, port, sni, TLS_TIMEOUT, probes.sem))
+        return job.tls_ms is not None
+
+    def download_stage(job: ScanJob) -> bool:
+        if engine is not None:
+            job.dl = engine.download_test(job.ep, test_url=DOWNLOAD_TEST_URL, timeout=DOWNLOAD_TIMEOUT)
+        else:
+            job.dl = real_download_test(
+                job.ep,
+                enabled=ENABLE_DOWNLOAD_TEST,
+                bin_name=SINGBOX_BIN,
+                test_url=DOWNLOAD_TEST_URL,
+                timeout=DOWNLOAD_TIMEOUT,
+                ready_timeout=SINGBOX_READY_TIMEOUT,
+            )
+        return job.dl[0]
+
+    available = {
+        "dns": (dns_stage, True, DNS_TIMEOUT, None),
+        "tcp": (tcp_stage, True, TCP_TIMEOUT, paced(tcp_key)),
+        "tls": (tls_stage, True, TLS_TIMEOUT, paced(tls_key)),
+        "download": (download_stage, False, DOWNLOAD_TIMEOUT, None),
+    }
+    stages: List[Stage] = []
+    for name in SCAN_STAGES:
+        if name == "download" and not download_active():
+            continue
+        run, is_async, timeout, pace = available[name]
+        if METRICS.enabled:
+            run = _timed(name, run, is_async)
+        n = workers.get(name, DEFAULT_WORKERS)
+        lo = hi = n
+        if ADAPTIVE_CONCURRENCY and name in ADAPTIVE_STAGES:
+            lo = max(1, n // CONCURRENCY_MIN_DIV)
+            hi = n * CONCURRENCY_MAX_MULT
+            if is_async:
+                hi = max(n, min(hi, probes.limit))
+            elif name == "download" and getattr(engine, "capacity", None):
+                # more tests than pool workers only queue for a worker
+                hi = min(hi, engine.capacity)
+                lo = min(lo, hi)
+        stages.append(Stage(name, run, n, is_async, lo, hi, timeout, pace))
+    return stages
+
+
+def _timed(name: str, run: Callable, is_async: bool) -> Callable:
+    if is_async:
+
+        async def timed_async(job: ScanJob) -> bool:
+            with METRICS.time(name):
+                return await run(job)
+
+        return timed_async
+
+    def timed(job: ScanJob) -> bool:
+        with METRICS.time(name):
+            return run(job)
+
+    return timed
+
+
+# ============================================================
+# Single scan
+# ============================================================
+def scan_one(
+    idx: int,
+    total: int,
+    ep: Endpoint,
+    engine=None,
+    probes: Optional[AsyncProbeEngine] = None,
+    resolver: Optional[Resolver] = None,
+) -> ScanResult:
+    own_probes = probes is None
+    own_resolver = resolver is None
+    if own_probes:
+        probes = AsyncProbeEngine(PROBE_MAX_IN_FLIGHT)
+    if own_resolver:
+        resolver = make_resolver()
+    try:
+        job = ScanJob(idx, total, ep)
+        for stage in build_stages(engine, probes, resolver=resolver):
+            ok = probes.submit(stage.run(job)).result() if stage.is_async else stage.run(job)
+            if not ok:
+                job.failed_stage = stage.name
+                break
+        return make_result(job)
+    finally:
+        if own_probes:
+            probes.close()
+        if own_resolver:
+            resolver.close()
+
+
 # ============================================================
 # Print chunk table
 # ============================================================
-def print_chunk(chunk_results: List[ScanResult], chunk_idx: int, chunk_total: int) -> None:
+def print_chunk(chunk_results: List[ScanResult], chunk_idx: int, done: int, total: int) -> None:
     c_alive = sum(1 for r in chunk_results if r.alive)
     c_dead = len(chunk_results) - c_alive
 
     console.print(
         Panel(
-            f"[bold]Chunk {chunk_idx}/{chunk_total}[/]  "
+            f"[bold]Chunk {chunk_idx}[/] [dim]({done}/{total} scanned)[/]  "
             f"[bold green]ALIVE[/]: {c_alive}  [bold red]DEAD[/]: {c_dead}",
             expand=False,
         )
     )
 
-    table = Table(title=f"Chunk {chunk_idx}/{chunk_total} Results")
+    table = Table(title=f"Chunk {chunk_idx} Results")
     table.add_column("#", justify="right", style="dim", width=4)
     table.add_column("Status", width=8)
     table.add_column("Type", width=7)
@@ -218,6 +582,49 @@ def print_chunk(chunk_results: List[ScanResult], chunk_idx: int, chunk_total: in
     console.print(table)
 
 
+# ============================================================
+# Sliding-window scheduler
+# ============================================================
+# Keeps `window` jobs in flight and refills as each one finishes, so no worker waits
+# for the slowest endpoint of a chunk. Yields the (endpoint, result) pairs finished
+# in each wait cycle; the result is None when the job raised.
+def stream_scan(
+    jobs: Iterator[Tuple[int, Endpoint]],
+    submit: Callable[[int, Endpoint], Future],
+    window: Union[int, Callable[[], int]],
+    should_stop: Callable[[], bool],
+) -> Iterator[List[Tuple[Endpoint, Optional[ScanResult]]]]:
+    pending: Dict[Future, Endpoint] = {}
+    exhausted = False
+    limit = window if callable(window) else lambda: window
+
+    while True:
+        while not exhausted and len(pending) < limit() and not should_stop():
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                break
+            idx, ep = job
+            pending[submit(idx, ep)] = ep
+
+        if should_stop():
+            for fut in pending:
+                fut.cancel()
+            return
+        if not pending:
+            return
+
+        done_set, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+        completed: List[Tuple[Endpoint, Optional[ScanResult]]] = []
+        for fut in done_set:
+            ep = pending.pop(fut)
+            try:
+                completed.append((ep, fut.result()))
+            except Exception:
+                completed.append((ep, None))
+        yield completed
+
+
 # ============================================================
 # Main Entry (used by app.py)
 # ============================================================
@@ -228,6 +635,10 @@ def scan_file(
     day_dir: str,
     workers: int = DEFAULT_WORKERS,
     chunk_size: int = CHUNK_SIZE,
+    force: bool = False,
+    metrics: bool = False,
+    metrics_port: Optional[int] = None,
+    resume: bool = False,
 ):
     scan_root, results_dir, whitelist_dir, failed_dir = ensure_scan_dirs()
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -236,32 +647,98 @@ def scan_file(
     whitelist_path = os.path.join(whitelist_dir, f"whitelist_{ts}.txt")
     failed_path = os.path.join(failed_dir, f"failed_{ts}.txt")
 
-    with open(input_txt, "r", encoding="utf-8", errors="replace") as f:
-        endpoints = extract_endpoints(f.read().splitlines())
+    digest = None
+    if PARSE_CACHE or JOURNAL or resume:
+        digest, lines_total = file_fingerprint(input_txt)
+    else:
+        lines_total = count_lines(input_txt)
+
+    journal_dir = os.path.join(scan_root, "journal")
+    journal = None
+    resumed_done: Dict[str, bool] = {}
+    if resume:
+        journal = ScanJournal.resume(journal_dir, digest)
+        if journal is None:
+            console.print(Panel("[yellow]No unfinished scan of this file to resume; starting a new one.[/]", expand=False))
+        else:
+            ts = journal.header["ts"]
+            results_path = journal.header["results"]
+            whitelist_path = journal.header["whitelist"]
+            failed_path = journal.header["failed"]
+            resumed_done = dict(journal.done)
+    if journal is None and JOURNAL:
+        journal = ScanJournal.create(
+            journal_dir,
+            digest,
+            ts,
+            input=os.path.abspath(input_txt),
+            results=results_path,
+            whitelist=whitelist_path,
+            failed=failed_path,
+        )
 
-    total = len(endpoints)
-    sb = has_singbox(SINGBOX_BIN)
+    if metrics_port is None:
+        metrics_port = METRICS_PORT
+    METRICS.enabled = metrics or METRICS_ENABLED or metrics_port is not None
+    METRICS.reset()
+    prom_path = summary_path = metrics_url = None
+    if METRICS.enabled:
+        metrics_dir = os.path.join(scan_root, "metrics")
+        os.makedirs(metrics_dir, exist_ok=True)
+        prom_path = os.path.join(metrics_dir, f"metrics_{ts}.prom")
+        summary_path = os.path.join(metrics_dir, f"metrics_{ts}.json")
+        if metrics_port is not None:
+            metrics_url = f"http://127.0.0.1:{METRICS.serve(metrics_port)}/metrics"
+
+    parse_cache = ParseCache(os.path.join(scan_root, "parse_cache"), PARSE_CACHE_KEEP) if PARSE_CACHE else None
+    cached = cache_writer = None
+    if parse_cache is not None:
+        cached = parse_cache.load(digest)
+        if cached is None:
+            cache_writer = parse_cache.writer(digest)
+    sb_info = singbox_info(SINGBOX_BIN)
+    sb = sb_info is not None
+    sb_mode = SINGBOX_MODE
+    if sb and sb_mode == "clash" and not sb_info.has_clash_api:
+        sb_mode = "batch"  # every clash group would fail and fall back to one process per endpoint
+    stage_names = [name for name in SCAN_STAGES if name != "download" or (ENABLE_DOWNLOAD_TEST and sb)]
+    if "download" not in stage_names:
+        chunk_size = max(chunk_size, PROBE_CHUNK_SIZE)
 
     console.print(
         Panel(
             "\n".join(
                 [
-                    "[bold cyan]SCAN (chunked + incremental save)[/]",
+                    "[bold cyan]SCAN (streaming + incremental save)[/]",
                     f"[dim]File:[/] {input_txt}",
-                    f"[dim]Configs:[/] {total}    [dim]Workers:[/] {workers}    [dim]Chunk:[/] {chunk_size}",
-                    f"[dim]sing-box:[/] {'[green]YES[/]' if sb else '[red]NO[/]'}",
+                    f"[dim]Lines:[/] {lines_total}    [dim]Workers:[/] {workers}    [dim]Chunk:[/] {chunk_size}"
+                    + ("    [dim]Parse cache:[/] hit" if cached is not None else ""),
+                    f"[dim]Stages:[/] {' → '.join(stage_names)}",
+                    f"[dim]sing-box:[/] {f'[green]YES[/] {sb_info.version}' if sb else '[red]NO[/]'}"
+                    + (f"    [dim]Mode:[/] {sb_mode}" if sb and ENABLE_DOWNLOAD_TEST else "")
+                    + (
+                        " [yellow](clash needs a sing-box built with_clash_api)[/]"
+                        if sb and ENABLE_DOWNLOAD_TEST and sb_mode != SINGBOX_MODE
+                        else ""
+                    ),
                     f"[dim]Output:[/] {scan_root}/ (results/ whitelist/ failed/)",
+                    *(
+                        [f"[dim]Resuming:[/] {len(resumed_done)} configs already done ({journal.path})"]
+                        if resumed_done
+                        else []
+                    ),
+                    *([f"[dim]Metrics:[/] {prom_path}" + (f"  {metrics_url}" if metrics_url else "")] if prom_path else []),
                 ]
             ),
             expand=False,
         )
     )
 
-    if total == 0:
-        console.print(Panel("[yellow]No configs found in the file.[/]", expand=False))
-        return
-
-    init_output_files(results_path, whitelist_path, failed_path)
+    written: Set[int] = set()
+    if resumed_done:
+        written = reopen_output_files(results_path, whitelist_path, failed_path)
+    else:
+        init_output_files(results_path, whitelist_path, failed_path)
 
     stop_now = False
 
@@ -271,124 +748,324 @@ def scan_file(
 
     old_handler = signal.signal(signal.SIGINT, _handle_sigint)
 
+    engine = None
+    if ENABLE_DOWNLOAD_TEST and sb:
+        engine = make_download_engine(
+            sb_mode,
+            SINGBOX_BIN,
+            batch_size=BATCH_SIZE,
+            linger=BATCH_LINGER,
+            pool_size=workers,
+            max_tests=POOL_MAX_TESTS,
+            ready_timeout=SINGBOX_READY_TIMEOUT,
+        )
+    probes = AsyncProbeEngine(PROBE_MAX_IN_FLIGHT)
+    resolver = make_resolver()
+    coalescer = ProbeCoalescer(PROBE_COALESCE_WINDOW) if PROBE_COALESCE else None
+    limiter = DestinationLimiter(DEST_HOST_RATE, DEST_HOST_BURST, DEST_IP_RATE, DEST_IP_BURST)
+    funnel = Funnel(
+        build_stages(engine, probes, {"download": workers}, resolver, coalescer, limiter),
+        make_result,
+        probes,
+        max_parked=SCAN_LOOKAHEAD,
+    )
+    controller = AimdController(
+        list(funnel.limits.values()),
+        CONCURRENCY_INTERVAL,
+        lambda line: console.print(f"[dim]Concurrency:[/] {line}"),
+    ).start()
+    history = HistoryStore(os.path.join(scan_root, "history.sqlite3")) if HISTORY else None
+    deduper = StreamDeduper() if DEDUPE else None
+
+    # Input pipeline: lines are parsed, deduped, history-ordered and DNS-warmed
+    # SCAN_LOOKAHEAD endpoints at a time, only as fast as the funnel frees slots.
+    parsed = admitted = known = stale = resumed = 0
+    source_done = False
+    resume_lines: List[Tuple[str, bool]] = []
+
+    def _admit(items: Iterator[Endpoint]) -> Iterator[Endpoint]:
+        nonlocal parsed, resumed
+        for ep in items:
+            parsed += 1
+            if cache_writer is not None:
+                if not ep.key:
+                    ep = replace(ep, key=key_of(ep))
+                cache_writer.add(ep)
+            if resumed_done:
+                alive = resumed_done.get(key_of(ep))
+                if alive is not None:
+                    # finished before the interruption; only save a duplicate line
+                    # that never made it into the outputs
+                    resumed += 1
+                    h = hash(ep.raw_line)
+                    if h not in written:
+                        written.add(h)
+                        resume_lines.append((ep.raw_line, alive))
+                    continue
+            if deduper is not None:
+                ep = deduper.admit(ep)
+            if ep is not None:
+                yield ep
+
+    def _source() -> Iterator[Tuple[int, Endpoint]]:
+        nonlocal admitted, known, stale, source_done
+        if cached is not None:
+            eps = _admit(cached)
+        else:
+            eps = _admit(iter_endpoints_parallel(input_txt, PARSE_WORKERS, PARSE_PARALLEL_MIN_BYTES))
+        while True:
+            block = list(islice(eps, SCAN_LOOKAHEAD))
+            if not block:
+                break
+            tiers = [block]
+            if history is not None:
+                tiers, seen, skipped = prioritize(
+                    block,
+                    [key_of(ep) for ep in block],
+                    history,
+                    HISTORY_STALE_AFTER,
+                    HISTORY_SKIP_STALE,
+                    force,
+                )
+                known += seen
+                stale += len(skipped)
+                if deduper is not None and HISTORY_SKIP_STALE:
+                    for ep in skipped:
+                        deduper.skip(ep)
+            # round-robin by host within each history tier, so the ordering holds
+            if DEST_INTERLEAVE:
+                tiers = [interleave(tier, lambda ep: ep.host) for tier in tiers]
+            block = [ep for tier in tiers for ep in tier]
+            if "dns" in stage_names:
+                probes.submit(resolver.bulk_resolve(ep.host for ep in block))
+            for ep in block:
+                admitted += 1
+                yield admitted, ep
+        source_done = True
+        if cache_writer is not None:
+            cache_writer.commit()
+
     alive_total = 0
     dead_total = 0
     done_total = 0
 
-    try:
-        chunks = [endpoints[i : i + chunk_size] for i in range(0, total, chunk_size)]
-        chunk_total = len(chunks)
-
-        for ci, chunk_eps in enumerate(chunks, start=1):
-            if stop_now:
-                break
-
-            progress = Progress(
-                SpinnerColumn(),
-                TextColumn(f"[bold]Scanning chunk {ci}/{chunk_total}[/]"),
-                BarColumn(),
-                TextColumn("done {task.completed}/{task.total}"),
-                TextColumn("[dim green]alive[/] {task.fields[alive]}"),
-                TextColumn("[dim red]dead[/] {task.fields[dead]}"),
-                TimeElapsedColumn(),
-                TimeRemainingColumn(),
-                console=console,
+    chunk_idx = 0
+    chunk_results: List[ScanResult] = []
+    last_report = time.monotonic()
+
+    def _report() -> None:
+        nonlocal chunk_idx, chunk_results, last_report, resume_lines
+        last_report = time.monotonic()
+        extra_lines = deduper.drain_late() if deduper is not None else []
+        if resume_lines:
+            extra_lines += resume_lines
+            resume_lines = []
+        if not chunk_results:
+            if extra_lines:
+                append_alias_lines(whitelist_path, failed_path, extra_lines)
+            return
+        chunk_idx += 1
+        with METRICS.time("render"):
+            print_chunk(chunk_results, chunk_idx, done_total, admitted if source_done else lines_total)
+
+        saved_alive, saved_dead = append_chunk_outputs(results_path, whitelist_path, failed_path, chunk_results)
+        late_alive, late_dead = append_alias_lines(whitelist_path, failed_path, extra_lines)
+        saved_alive += late_alive
+        saved_dead += late_dead
+        keys = [key_of(r.ep) for r in chunk_results]
+        if journal is not None:
+            journal.record(zip(keys, (r.alive for r in chunk_results)))
+        if history is not None:
+            history.record(
+                (key, r.alive, r.failed_stage, r.dl_ms if r.dl_ok else r.tcp_avg_ms)
+                for key, r in zip(keys, chunk_results)
             )
+        chunk_results = []
+        if prom_path is not None:
+            METRICS.write_prometheus(prom_path)
+
+        console.print(
+            Panel(
+                "\n".join(
+                    [
+                        f"[bold]Saved chunk {chunk_idx}[/]  "
+                        f"[dim]({saved_alive} alive, {saved_dead} dead)[/]",
+                        f"[dim]Results:[/]   {results_path}",
+                        f"[dim]Whitelist:[/] {whitelist_path}",
+                        f"[dim]Failed:[/]    {failed_path}",
+                    ]
+                ),
+                expand=False,
+            )
+        )
+        console.print(
+            Panel(
+                f"[bold]Total so far[/]  "
+                f"[bold green]ALIVE[/]: {alive_total}/{done_total}    "
+                f"[bold red]DEAD[/]: {dead_total}/{done_total}",
+                expand=False,
+            )
+        )
 
-            chunk_alive = 0
-            chunk_dead = 0
-            chunk_results: List[ScanResult] = []
-
-            with progress:
-                task = progress.add_task("scan", total=len(chunk_eps), alive=0, dead=0)
-
-                with ThreadPoolExecutor(max_workers=workers) as ex:
-                    futures = []
-                    for offset, ep in enumerate(chunk_eps):
-                        if stop_now:
-                            break
-                        global_idx = (ci - 1) * chunk_size + offset + 1  # 1-based index
-                        futures.append(ex.submit(scan_one, global_idx, total, ep))
-
-                    pending = set(futures)
-
-                    while pending and not stop_now:
-                        done_set, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
-                        for fut in done_set:
-                            try:
-                                r = fut.result()
-                            except Exception:
-                                chunk_dead += 1
-                                dead_total += 1
-                                done_total += 1
-                                progress.advance(task, 1)
-                                progress.update(task, alive=chunk_alive, dead=chunk_dead)
-                                continue
-
-                            chunk_results.append(r)
-
-                            done_total += 1
-                            if r.alive:
-                                chunk_alive += 1
-                                alive_total += 1
-                            else:
-                                chunk_dead += 1
-                                dead_total += 1
-
-                            progress.advance(task, 1)
-                            progress.update(task, alive=chunk_alive, dead=chunk_dead)
-
-                    if stop_now:
-                        console.print("[yellow]\nStopping... cancelling pending tasks.[/]")
-                        for fut in pending:
-                            fut.cancel()
-                        ex.shutdown(wait=False, cancel_futures=True)
-
-            if chunk_results:
-                print_chunk(chunk_results, ci, chunk_total)
-
-                saved_alive, saved_dead = append_chunk_outputs(
-                    results_path, whitelist_path, failed_path, chunk_results
-                )
+    def _submit(idx: int, ep: Endpoint) -> Future:
+        return funnel.submit(ScanJob(idx, lines_total, ep))
+
+    progress = Progress(
+        SpinnerColumn(),
+        TextColumn("[bold]Scanning[/]"),
+        BarColumn(),
+        TextColumn("done {task.completed}/{task.total}"),
+        TextColumn("[dim green]alive[/] {task.fields[alive]}"),
+        TextColumn("[dim red]dead[/] {task.fields[dead]}"),
+        TimeElapsedColumn(),
+        TimeRemainingColumn(),
+        console=console,
+    )
 
-                console.print(
-                    Panel(
-                        "\n".join(
-                            [
-                                f"[bold]Saved chunk {ci}/{chunk_total}[/]  "
-                                f"[dim]({saved_alive} alive, {saved_dead} dead)[/]",
-                                f"[dim]Results:[/]   {results_path}",
-                                f"[dim]Whitelist:[/] {whitelist_path}",
-                                f"[dim]Failed:[/]    {failed_path}",
-                            ]
-                        ),
-                        expand=False,
-                    )
+    try:
+        with progress:
+            task = progress.add_task("scan", total=lines_total, alive=0, dead=0)
+
+            for completed in stream_scan(_source(), _submit, lambda: funnel.window, lambda: stop_now):
+                for ep, r in completed:
+                    done_total += 1
+                    if r is not None and r.alive:
+                        alive_total += 1
+                    else:
+                        dead_total += 1
+                    if deduper is not None:
+                        ep = deduper.finish(ep, r is not None and r.alive)
+                        if r is not None and ep is not r.ep:
+                            r = replace(r, ep=ep)
+                    if r is not None:
+                        chunk_results.append(r)
+                    progress.advance(task, 1)
+                progress.update(
+                    task, alive=alive_total, dead=dead_total, **({"total": admitted} if source_done else {})
                 )
 
-            console.print(
-                Panel(
-                    f"[bold]Total so far[/]  "
-                    f"[bold green]ALIVE[/]: {alive_total}/{done_total}    "
-                    f"[bold red]DEAD[/]: {dead_total}/{done_total}",
-                    expand=False,
-                )
-            )
+                if len(chunk_results) >= chunk_size or (
+                    chunk_results and time.monotonic() - last_report >= REPORT_INTERVAL
+                ):
+                    _report()
+
+            if stop_now:
+                console.print("[yellow]\nStopping... cancelling pending tasks.[/]")
+
+        _report()
+        if journal is not None and not stop_now:
+            journal.finish()
+            prune_journals(journal_dir, digest, journal.path)
 
     finally:
+        if cache_writer is not None:
+            cache_writer.abort()
+        if journal is not None:
+            journal.close()
+        controller.stop()
+        funnel.close()
+        if engine is not None:
+            engine.close()
+        probes.close()
+        resolver.close()
+        if history is not None:
+            history.close()
         signal.signal(signal.SIGINT, old_handler)
+        if prom_path is not None:
+            METRICS.stop_server()
+            METRICS.write_prometheus(prom_path)
+            METRICS.write_summary(summary_path)
+            METRICS.enabled = False
+
+    if admitted == 0 and not stop_now:
+        if resumed:
+            msg = f"All {resumed} configs were already scanned before the interruption."
+        elif stale:
+            msg = "Every config was skipped by history (use force)."
+        else:
+            msg = "No configs found in the file."
+        if not resumed_done:
+            # nothing was scanned: leave no empty outputs or journal behind
+            for path in (results_path, whitelist_path, failed_path, journal.path if journal is not None else None):
+                if path is not None:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        console.print(Panel(f"[yellow]{msg}[/]", expand=False))
+        return
 
+    port_stats = PORTS.stats()
+    engine_stats = engine.stats() if engine is not None else {}
+    stage_lines = [
+        f"[dim]{name}:[/] {passed}/{entered} passed ({passed * 100 // entered if entered else 0}%)"
+        for name, entered, passed in funnel.stats()
+    ]
+    timing_lines = []
+    if prom_path is not None:
+        for name, row in METRICS.summary()["stages"].items():
+            timing_lines.append(
+                f"[dim]{name}:[/] {row['count']}x  mean {row['mean_ms']} ms  "
+                f"p50 {row['p50_ms']} ms  p90 {row['p90_ms']} ms  p99 {row['p99_ms']} ms"
+            )
     console.print(
         Panel(
             "\n".join(
                 [
                     "[bold]DONE[/]" if not stop_now else "[bold yellow]STOPPED[/]",
+                    f"[dim]Configs:[/] {admitted} scanned of {parsed} parsed"
+                    + (f" [dim]({deduper.merged} duplicates merged)[/]" if deduper is not None and deduper.merged else ""),
+                    *([f"[dim]Resumed:[/] {resumed} already done before the interruption"] if resumed else []),
+                    *(
+                        ["[dim]Journal:[/] continue this scan with --resume"]
+                        if stop_now and journal is not None
+                        else []
+                    ),
+                    *(
+                        [
+                            f"[dim]History:[/] {known} seen before, {stale} dead in last {HISTORY_STALE_AFTER} scans "
+                            + ("(forced)" if force else "(skipped)" if HISTORY_SKIP_STALE else "(deferred)")
+                        ]
+                        if HISTORY
+                        else []
+                    ),
                     f"[bold green]ALIVE[/]: {alive_total}/{done_total}    [bold red]DEAD[/]: {dead_total}/{done_total}",
+                    f"[dim]Ports:[/] {port_stats['leases']} leased, {port_stats['retries']} retries, "
+                    f"peak {port_stats['peak']} in use",
+                    *(
+                        [
+                            f"[dim]DNS:[/] {resolver.misses} lookups, {resolver.hits} cache hits, "
+                            f"{resolver.failures} failed"
+                        ]
+                        if resolver.misses or resolver.hits
+                        else []
+                    ),
+                    *(
+                        [f"[dim]Probes:[/] {coalescer.probed} run, {coalescer.shared} shared by same ip:port"]
+                        if coalescer is not None
+                        else []
+                    ),
+                    *(
+                        [f"[dim]sing-box:[/] {', '.join(f'{n} {k}' for k, n in engine_stats.items())}"]
+                        if engine_stats
+                        else []
+                    ),
+                    *(
+                        [f"[dim]Pacing:[/] {limiter.deferred} held back by per-host/per-IP limits"]
+                        if limiter.enabled
+                        else []
+                    ),
+                    "",
+                    "[bold]STAGES[/]",
+                    *stage_lines,
+                    *([f"[dim]Concurrency:[/] {', '.join(controller.summary())}"] if controller.limits else []),
+                    *(["", "[bold]TIMINGS[/]", *timing_lines] if timing_lines else []),
                     "",
                     "[bold]FILES SAVED[/]",
                     f"[dim]Results:[/]   {results_path}",
                     f"[dim]Whitelist:[/] {whitelist_path}",
                     f"[dim]Failed:[/]    {failed_path}",
+                    *([f"[dim]Metrics:[/]   {prom_path}", f"[dim]Summary:[/]   {summary_path}"] if prom_path else []),
                 ]
             ),
             expand=False,
@@ -1,11 +1,17 @@
 import base64
 import json
+import mmap
+import multiprocessing
+import os
 import re
 import socket
 import statistics
+import sys
 import time
-from dataclasses import dataclass
-from typing import Iterable, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import parse_qs, unquote, urlparse
 
 
@@ -13,12 +19,51 @@ from urllib.parse import parse_qs, unquote, urlparse
 # Regex / Patterns
 # =========================
 VMESS_RE = re.compile(r"^vmess://([A-Za-z0-9+/=_-]+)")
+SHARE_SCHEMES = ("vmess://", "vless://", "trojan://", "ss://")
+SHARE_SCHEMES_B = tuple(x.encode() for x in SHARE_SCHEMES)
+LINK_START_RE = re.compile(r"(?<![A-Za-z])(?:vmess|vless|trojan|ss)://")
+B64_LINE_RE = re.compile(r"[A-Za-z0-9+/_-]+={0,2}")
+B64_LINE_BYTES_RE = re.compile(rb"[A-Za-z0-9+/_-]+={0,2}")
+
+# bump whenever the parsers or Endpoint/Link change shape; invalidates parse caches
+PARSER_VERSION = 4
 
 
 # =========================
 # Data Models
 # =========================
-@dataclass(frozen=True)
+# Everything the outbound builders need from a share line beyond the endpoint's
+# own server, port and network, decoded once by the parsers. cred is the uuid
+# (vmess/vless) or password (trojan/ss); method is the vmess security or ss cipher;
+# host is the ws Host header. Everything but cred repeats across a list (one
+# server or CDN front per many configs), so those strings are interned.
+class Link:
+    __slots__ = ("cred", "method", "tls", "sni", "path", "host", "service_name", "flow")
+
+    def __init__(
+        self,
+        cred: str,
+        method: str = "",
+        tls: bool = False,
+        sni: str = "",
+        path: str = "/",
+        host: str = "",
+        service_name: str = "",
+        flow: str = "",
+    ) -> None:
+        self.cred = cred
+        self.method = sys.intern(method)
+        self.tls = tls
+        self.sni = sys.intern(sni)
+        self.path = sys.intern(path)
+        self.host = sys.intern(host)
+        self.service_name = sys.intern(service_name)
+        self.flow = sys.intern(flow)
+
+
+# Slotted, with host and network interned (see _endpoint): a scan can hold many of
+# these at once.
+@dataclass(frozen=True, slots=True)
 class Endpoint:
     scheme: str
     host: str
@@ -26,6 +71,14 @@ class Endpoint:
     network: str
     tag: str
     raw_line: str
+    aliases: Tuple[str, ...] = ()  # duplicate share lines merged into this endpoint
+    key: str = ""  # canonical identity, filled in by dedupe
+    link: Optional[Link] = field(default=None, compare=False, repr=False)  # None if the credentials did not decode
+    line_no: int = field(default=0, compare=False)  # 1-based line in the input file, 0 if unknown
+
+
+def _endpoint(scheme: str, host: str, port: int, network: str, tag: str, raw_line: str, link: Optional[Link]) -> Endpoint:
+    return Endpoint(scheme, sys.intern(host), port, sys.intern(network), tag, raw_line, link=link)
 
 
 @dataclass(frozen=True)
@@ -41,15 +94,9 @@ class ScanResult:
     dl_reason: str
     dl_ms: Optional[float]
     http_status: Optional[int]
-
-    @property
-    def alive(self) -> bool:
-        from .singbox_tools import has_singbox
-        from .scanner import ENABLE_DOWNLOAD_TEST, TCP_TRIES
-
-        if ENABLE_DOWNLOAD_TEST and has_singbox():
-            return self.dl_ok
-        return self.tcp_avg_ms is not None and self.tcp_fails < TCP_TRIES
+    alive: bool
+    tls_ms: Optional[float] = None
+    failed_stage: Optional[str] = None
 
 
 # =========================
@@ -74,6 +121,8 @@ def _clean_share_line(line: str) -> str:
 # Parsers
 # =========================
 def parse_vmess(line: str) -> Optional[Endpoint]:
+    if "@" in line.split("#", 1)[0]:
+        return _parse_url_scheme(line, "vmess")
     line = _clean_share_line(line)
     m = VMESS_RE.match(line)
     if not m:
@@ -95,7 +144,18 @@ def parse_vmess(line: str) -> Optional[Endpoint]:
     except Exception:
         return None
 
-    return Endpoint("vmess", host, port, net, tag, raw_line=line)
+    tls_val = (data.get("tls") or "").strip()
+    hdr_host = (data.get("host") or "").strip()
+    link = Link(
+        (data.get("id") or "").strip(),
+        method=(data.get("scy") or "auto").strip() or "auto",
+        tls=tls_val in ("tls", "reality") or (port == 443 and tls_val != "none"),
+        sni=(data.get("sni") or "").strip() or hdr_host,
+        path=(data.get("path") or "").strip() or "/",
+        host=hdr_host,
+        service_name=(data.get("serviceName") or data.get("servicename") or "").strip(),
+    )
+    return _endpoint("vmess", host, port, net, tag, line, link)
 
 
 def _parse_url_scheme(line: str, scheme: str) -> Optional[Endpoint]:
@@ -106,15 +166,43 @@ def _parse_url_scheme(line: str, scheme: str) -> Optional[Endpoint]:
         host = u.hostname
         port = u.port
         qs = parse_qs(u.query)
-        net = (qs.get("type", ["tcp"])[0] or "tcp").strip()
+
+        def q(name: str, default: str = "") -> str:
+            return qs.get(name, [default])[0] or default
+
+        net = q("type", "tcp").strip()
         tag = (u.fragment or "").strip()
         if not host or not port:
             return None
-        return Endpoint(scheme, host, int(port), net, tag, raw_line=line.strip())
+
+        hdr_host = q("host").strip()
+        if scheme == "trojan":
+            tls, sni = True, (q("sni") or q("peer")).strip()
+        else:
+            tls, sni = q("security").strip() in ("tls", "reality"), (q("sni") or hdr_host).strip()
+        link = Link(
+            (u.username or "").strip(),
+            method=q("encryption", "auto").strip() if scheme == "vmess" else "",
+            tls=tls,
+            sni=sni,
+            path=q("path", "/"),
+            host=hdr_host,
+            service_name=q("serviceName").strip(),
+            flow=q("flow").strip(),
+        )
+        return _endpoint(scheme, host, int(port), net, tag, line.strip(), link)
     except Exception:
         return None
 
 
+def _ss_link(creds: str) -> Optional[Link]:
+    try:
+        method, password = creds.split(":", 1)
+    except ValueError:
+        return None
+    return Link(password.strip(), method=method.strip())
+
+
 def parse_ss(line: str) -> Optional[Endpoint]:
     s = line.strip()
     if not s.startswith("ss://"):
@@ -129,14 +217,20 @@ def parse_ss(line: str) -> Optional[Endpoint]:
 
     try:
         if "@" in body:
-            _, right = body.split("@", 1)
+            left, right = body.split("@", 1)
             host, port_str = right.rsplit(":", 1)
-            return Endpoint("ss", host.strip("[]"), int(port_str), "tcp", tag, raw_line=line.strip())
+            host, port = host.strip("[]"), int(port_str)
+            try:
+                creds = _b64_decode_any(left).decode("utf-8", errors="replace") if ":" not in left else left
+            except Exception:
+                creds = ""
+            return _endpoint("ss", host, port, "tcp", tag, line.strip(), _ss_link(creds))
 
         dec = _b64_decode_any(body).decode("utf-8", errors="replace")
-        _, addr = dec.rsplit("@", 1)
+        creds, addr = dec.rsplit("@", 1)
         host, port_str = addr.rsplit(":", 1)
-        return Endpoint("ss", host.strip("[]"), int(port_str), "tcp", tag, raw_line=line.strip())
+        host, port = host.strip("[]"), int(port_str)
+        return _endpoint("ss", host, port, "tcp", tag, line.strip(), _ss_link(creds))
     except Exception:
         return None
 
@@ -157,13 +251,301 @@ def parse_any_line(line: str) -> Optional[Endpoint]:
     return None
 
 
+# =========================
+# Subscription decoding
+# =========================
+# Subscription bodies come as plain share lines, one base64 blob (often a single
+# line, sometimes wrapped at 76 columns), several encoded blocks mixed with plain
+# lines, or links wrapped in quotes / JSON arrays / list markers. decode_subscription
+# turns all of those into plain share lines. Base64 is decoded B64_CHUNK characters
+# at a time and split into lines as it goes, so a large blob is never held twice.
+B64_MIN_LINE = 16  # shorter runs only count as base64 inside an open block
+B64_CHUNK = 1 << 16
+LINK_WRAP_CHARS = " \t\"',[]"
+
+
+class _Base64Lines:
+    def __init__(self) -> None:
+        self._buf = ""
+        self._tail = b""
+
+    def feed(self, s: str) -> Iterator[str]:
+        for i in range(0, len(s), B64_CHUNK):
+            self._buf += s[i : i + B64_CHUNK]
+            yield from self._drain(False)
+
+    def finish(self) -> Iterator[str]:
+        yield from self._drain(True)
+        if self._tail:
+            yield self._tail.decode("utf-8", errors="replace").rstrip("\r")
+        self._tail = b""
+
+    def _drain(self, final: bool) -> Iterator[str]:
+        buf = self._buf
+        eq = buf.rfind("=")
+        if final:
+            take = len(buf)
+        elif eq >= 0:  # a padded block ends here; whatever follows starts a new one
+            take = eq + 1
+        else:
+            take = len(buf) - len(buf) % 4
+        if not take:
+            return
+        self._buf = buf[take:]
+        data = self._tail
+        for part in re.split(r"(?<==)(?=[^=])", buf[:take]):
+            data += _b64_decode_any(part)
+        *lines, self._tail = data.split(b"\n")
+        for ln in lines:
+            yield ln.decode("utf-8", errors="replace").rstrip("\r")
+
+
+# every link in a line of wrapped or decoded text, stripped of quotes/commas/brackets;
+# also separates links whose base64 lines were decoded back to back
+def _split_links(s: str) -> List[str]:
+    starts = [m.start() for m in LINK_START_RE.finditer(s)]
+    if not starts:
+        return [s]
+    return [s[a:b].rstrip(LINK_WRAP_CHARS) for a, b in zip(starts, starts[1:] + [len(s)])]
+
+
+def _starts_with_link(s: str) -> bool:
+    try:
+        head = _b64_decode_any(s[:16])
+    except ValueError:
+        return False
+    return head.startswith(SHARE_SCHEMES_B)
+
+
+# a whole base64 blob on one line
+def _padded(s: str) -> bool:
+    return s.endswith("=") and len(s) % 4 == 0
+
+
+def _decode_line(s: str) -> List[str]:
+    try:
+        text = _b64_decode_any(s).decode("utf-8", errors="replace")
+    except ValueError:
+        return []
+    return [link for ln in text.splitlines() for link in _split_links(ln.strip())]
+
+
+# A block of base64 lines is either one blob wrapped over several lines or one
+# encoded link per line; it is the latter when the first two lines each decode
+# to the start of a share link on their own. A first line that does not decode to
+# a link start, followed by one that does (or by a padded blob), is a title or
+# separator and is closed as a block of its own.
+def decode_subscription(lines: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+    block: Optional[_Base64Lines] = None
+    block_line = 0
+    first: Optional[str] = None
+    per_line = False
+
+    def _feed(s: str) -> Iterator[Tuple[int, str]]:
+        for out in block.feed(s):
+            for link in _split_links(out):
+                yield block_line, link
+
+    def _close() -> Iterator[Tuple[int, str]]:
+        try:
+            if first is not None:
+                yield from _feed(first)
+            for out in block.finish():
+                for link in _split_links(out):
+                    yield block_line, link
+        except ValueError:
+            pass
+
+    for line_no, ln in lines:
+        s = ln.strip()
+        if s and (block is not None or len(s) >= B64_MIN_LINE) and B64_LINE_RE.fullmatch(s):
+            if block is None:
+                block, block_line, first, per_line = _Base64Lines(), line_no, s, False
+                continue
+            if first is not None and not _starts_with_link(first) and (_starts_with_link(s) or _padded(s)):
+                # `first` was a title or separator that only looked like base64
+                for link in _decode_line(first):
+                    yield block_line, link
+                block, block_line, first = _Base64Lines(), line_no, s
+                continue
+            if first is not None:
+                per_line = _starts_with_link(first) and _starts_with_link(s)
+                if per_line:
+                    for link in _decode_line(first):
+                        yield block_line, link
+                    first = None
+            if per_line:
+                for link in _decode_line(s):
+                    yield line_no, link
+                continue
+            try:
+                if first is not None:
+                    yield from _feed(first)
+                    first = None
+                yield from _feed(s)
+            except ValueError:  # not base64 after all
+                block = first = None
+            continue
+
+        if block is not None:
+            yield from _close()
+            block = first = None
+        if s.startswith(SHARE_SCHEMES):
+            yield line_no, s
+        else:
+            for link in _split_links(s):
+                yield line_no, link
+
+    if block is not None:
+        yield from _close()
+
+
+# Endpoints built by hand (or before the link record existed) are parsed again.
+def link_of(ep: Endpoint) -> Link:
+    if ep.link is not None:
+        return ep.link
+    parsed = parse_any_line(ep.raw_line)
+    if parsed is None or parsed.link is None:
+        raise ValueError(f"cannot decode {ep.scheme} link")
+    return parsed.link
+
+
 def extract_endpoints(lines: Iterable[str]) -> List[Endpoint]:
-    out: List[Endpoint] = []
-    for ln in lines:
+    return list(iter_endpoints(enumerate(lines, start=1)))
+
+
+# =========================
+# Streaming input
+# =========================
+# Lines are read from a read-only mapping so a multi-GB subscription dump is paged
+# in by the OS as the scan advances instead of being loaded up front.
+def iter_file_lines(path: str) -> Iterator[Tuple[int, str]]:
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return
+        with mm:
+            for line_no, raw in enumerate(iter(mm.readline, b""), start=1):
+                yield line_no, raw.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+def count_lines(path: str, block: int = 1 << 20) -> int:
+    n = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(block), b""):
+            n += buf.count(b"\n")
+            last = buf[-1:]
+    return n + (last != b"\n")
+
+
+def iter_endpoints(lines: Iterable[Tuple[int, str]]) -> Iterator[Endpoint]:
+    for line_no, ln in decode_subscription(lines):
         ep = parse_any_line(ln)
         if ep:
-            out.append(ep)
-    return out
+            yield replace(ep, line_no=line_no)
+
+
+# =========================
+# Parallel parsing
+# =========================
+# Big files are cut into newline-aligned byte ranges that worker processes parse
+# on their own; endpoints travel back as plain tuples (much smaller to pickle than
+# dataclasses) and are yielded in file order with their original line numbers.
+# At most 2 shards per worker are parsed ahead of the consumer.
+PARSE_SHARD_BYTES = 4 << 20
+
+
+def pack_endpoint(ep: Endpoint) -> tuple:
+    link = None if ep.link is None else tuple(getattr(ep.link, name) for name in Link.__slots__)
+    return (ep.scheme, ep.host, ep.port, ep.network, ep.tag, ep.raw_line, ep.line_no, link, ep.key)
+
+
+def unpack_endpoint(t: tuple, line_offset: int = 0) -> Endpoint:
+    scheme, host, port, network, tag, raw_line, line_no, link, key = t
+    return Endpoint(
+        scheme,
+        sys.intern(host),
+        port,
+        sys.intern(network),
+        tag,
+        raw_line,
+        key=key,
+        link=None if link is None else Link(*link),
+        line_no=line_no + line_offset,
+    )
+
+
+def shard_ranges(path: str, shard_bytes: int = PARSE_SHARD_BYTES) -> List[Tuple[int, int]]:
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges: List[Tuple[int, int]] = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            nl = mm.find(b"\n", min(start + shard_bytes, size) - 1)
+            end = size if nl < 0 else nl + 1
+            # never cut a wrapped base64 block in two
+            while end < size:
+                nxt = mm.find(b"\n", end)
+                stop = size if nxt < 0 else nxt + 1
+                if not B64_LINE_BYTES_RE.fullmatch(mm[end:stop].strip()):
+                    break
+                end = stop
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# returns (lines in the shard, packed endpoints numbered from 1 within the shard)
+def parse_shard(path: str, start: int, end: int) -> Tuple[int, List[tuple]]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        buf = f.read(end - start)
+    lines = buf.split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    decoded = ((i, raw.decode("utf-8", errors="replace").rstrip("\r")) for i, raw in enumerate(lines, start=1))
+    return len(lines), [pack_endpoint(ep) for ep in iter_endpoints(decoded)]
+
+
+def iter_endpoints_parallel(path: str, workers: int, min_bytes: int = 4 * PARSE_SHARD_BYTES) -> Iterator[Endpoint]:
+    if workers <= 1 or os.path.getsize(path) < min_bytes:
+        yield from iter_endpoints(iter_file_lines(path))
+        return
+    # by now the scan's probe loop and worker threads are running; forking a
+    # threaded process can leave a child stuck on a lock one of them held
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    except (OSError, NotImplementedError, ValueError):  # no multiprocessing support here
+        yield from iter_endpoints(iter_file_lines(path))
+        return
+
+    ranges = deque(shard_ranges(path))
+    pending = deque()
+    offset = 0
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < 2 * workers:
+                start, end = ranges.popleft()
+                try:
+                    fut = pool.submit(parse_shard, path, start, end)
+                except RuntimeError:  # pool broken or shut down
+                    fut = None
+                pending.append(((start, end), fut))
+            (start, end), fut = pending.popleft()
+            try:
+                n_lines, packed = fut.result() if fut is not None else parse_shard(path, start, end)
+            except Exception:  # worker died: parse this shard here
+                n_lines, packed = parse_shard(path, start, end)
+            for t in packed:
+                yield unpack_endpoint(t, offset)
+            offset += n_lines
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
 
 
 # =========================
@@ -1,23 +1,66 @@
-import hashlib
 import json
 import os
+import queue
+import shutil
+import signal
+import socket
 import subprocess
 import tempfile
+import threading
 import time
-from typing import Optional, Tuple
-from urllib.parse import parse_qs, urlparse
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 import requests
 
-from .scanner_core import Endpoint, VMESS_RE, _b64_decode_any
+from .metrics import METRICS
+from .ports import PORTS
+from .scanner_core import Endpoint, Link, link_of
 
 
-def has_singbox(bin_name: str = "sing-box") -> bool:
+# =========================
+# Binary info
+# =========================
+# Version and build tags as reported by `sing-box version`.
+@dataclass(frozen=True)
+class SingboxInfo:
+    version: str
+    tags: Tuple[str, ...]
+
+    # "clash" mode asks the binary itself for delays; plain builds lack the API
+    @property
+    def has_clash_api(self) -> bool:
+        return "with_clash_api" in self.tags
+
+
+# Probed once per binary for the life of the process.
+@lru_cache(maxsize=None)
+def singbox_info(bin_name: str = "sing-box") -> Optional[SingboxInfo]:
+    path = shutil.which(bin_name)
+    if not path:
+        return None
     try:
-        r = subprocess.run([bin_name, "version"], capture_output=True, text=True, timeout=3)
-        return r.returncode == 0
+        r = subprocess.run([path, "version"], capture_output=True, text=True, timeout=3)
     except Exception:
-        return False
+        return None
+    if r.returncode != 0:
+        return None
+
+    version = ""
+    tags: Tuple[str, ...] = ()
+    for line in r.stdout.splitlines():
+        line = line.strip()
+        if line.startswith("sing-box version"):
+            version = line[len("sing-box version"):].strip()
+        elif line.startswith("Tags:"):
+            tags = tuple(t.strip() for t in line[len("Tags:"):].split(",") if t.strip())
+    return SingboxInfo(version, tags)
+
+
+def has_singbox(bin_name: str = "sing-box") -> bool:
+    return singbox_info(bin_name) is not None
 
 
 def _short_dl_reason(err: Exception) -> str:
@@ -33,181 +76,222 @@ def _short_dl_reason(err: Exception) -> str:
     return "failed"
 
 
-def _alloc_socks_port(ep: Endpoint) -> int:
-    h = int(hashlib.sha1(ep.raw_line.encode("utf-8")).hexdigest()[:6], 16)
-    return 20000 + (h % 15000)
-
-
-def _safe_int(v, default: int) -> int:
-    try:
-        return int(v)
-    except Exception:
-        return default
-
-
 # =========================
 # Outbound builders
 # =========================
-def _vmess_outbound(ep: Endpoint) -> dict:
-    b64 = VMESS_RE.match(ep.raw_line).group(1)
-    data = json.loads(_b64_decode_any(b64).decode("utf-8", errors="replace"))
-
-    server = (data.get("add") or "").strip()
-    port = _safe_int(data.get("port"), ep.port)
-    uuid_ = (data.get("id") or "").strip()
-    security = (data.get("scy") or "auto").strip() or "auto"
-    net = (data.get("net") or "tcp").strip() or "tcp"
-    host = (data.get("host") or "").strip()
-    path = (data.get("path") or "").strip() or "/"
-    tls_val = (data.get("tls") or "").strip()
-    sni = (data.get("sni") or "").strip() or (host if host else "")
-
-    ob = {
-        "type": "vmess",
-        "tag": "proxy",
-        "server": server,
-        "server_port": port,
-        "uuid": uuid_,
-        "security": security,
-        "alter_id": 0,
-    }
-
-    tls_enabled = tls_val in ("tls", "reality") or (port == 443 and tls_val != "none")
-    if tls_enabled:
+def _tls_transport(ob: dict, ep: Endpoint, link: Link, grpc: bool = True) -> dict:
+    if link.tls:
         ob["tls"] = {"enabled": True}
-        if sni:
-            ob["tls"]["server_name"] = sni
-
-    if net == "ws":
-        ob["transport"] = {"type": "ws", "path": path}
-        if host:
-            ob["transport"]["headers"] = {"Host": host}
-    elif net == "grpc":
-        svc = (data.get("serviceName") or data.get("servicename") or "").strip()
+        if link.sni:
+            ob["tls"]["server_name"] = link.sni
+
+    if ep.network == "ws":
+        ob["transport"] = {"type": "ws", "path": link.path}
+        if link.host:
+            ob["transport"]["headers"] = {"Host": link.host}
+    elif ep.network == "grpc" and grpc:
         ob["transport"] = {"type": "grpc"}
-        if svc:
-            ob["transport"]["service_name"] = svc
+        if link.service_name:
+            ob["transport"]["service_name"] = link.service_name
 
     return ob
 
 
-def _vless_outbound(ep: Endpoint) -> dict:
-    u = urlparse(ep.raw_line)
-    uuid_ = (u.username or "").strip()
-    server = u.hostname or ep.host
-    port = u.port or ep.port
-    qs = parse_qs(u.query)
-
-    transport = (qs.get("type", ["tcp"])[0] or "tcp").strip()
-    security = (qs.get("security", [""])[0] or "").strip()
-    sni = (qs.get("sni", [""])[0] or qs.get("host", [""])[0] or "").strip()
-    path = (qs.get("path", [""])[0] or "/")
-    host = (qs.get("host", [""])[0] or "").strip()
-    service_name = (qs.get("serviceName", [""])[0] or "").strip()
-    flow = (qs.get("flow", [""])[0] or "").strip()
-
-    ob = {"type": "vless", "tag": "proxy", "server": server, "server_port": port, "uuid": uuid_}
-    if flow:
-        ob["flow"] = flow
-
-    if security in ("tls", "reality"):
-        ob["tls"] = {"enabled": True}
-        if sni:
-            ob["tls"]["server_name"] = sni
-
-    if transport == "ws":
-        ob["transport"] = {"type": "ws", "path": path}
-        if host:
-            ob["transport"]["headers"] = {"Host": host}
-    elif transport == "grpc":
-        ob["transport"] = {"type": "grpc"}
-        if service_name:
-            ob["transport"]["service_name"] = service_name
-
-    return ob
+def _vmess_outbound(ep: Endpoint, tag: str = "proxy") -> dict:
+    link = link_of(ep)
+    ob = {
+        "type": "vmess",
+        "tag": tag,
+        "server": ep.host,
+        "server_port": ep.port,
+        "uuid": link.cred,
+        "security": link.method,
+        "alter_id": 0,
+    }
+    return _tls_transport(ob, ep, link)
 
 
-def _trojan_outbound(ep: Endpoint) -> dict:
-    u = urlparse(ep.raw_line)
-    password = (u.username or "").strip()
-    server = u.hostname or ep.host
-    port = u.port or ep.port
-    qs = parse_qs(u.query)
+def _vless_outbound(ep: Endpoint, tag: str = "proxy") -> dict:
+    link = link_of(ep)
+    ob = {"type": "vless", "tag": tag, "server": ep.host, "server_port": ep.port, "uuid": link.cred}
+    if link.flow:
+        ob["flow"] = link.flow
+    return _tls_transport(ob, ep, link)
 
-    sni = (qs.get("sni", [""])[0] or qs.get("peer", [""])[0] or "").strip()
-    transport = (qs.get("type", ["tcp"])[0] or "tcp").strip()
-    path = (qs.get("path", [""])[0] or "/")
-    host = (qs.get("host", [""])[0] or "").strip()
 
+def _trojan_outbound(ep: Endpoint, tag: str = "proxy") -> dict:
+    link = link_of(ep)
     ob = {
         "type": "trojan",
-        "tag": "proxy",
-        "server": server,
-        "server_port": port,
-        "password": password,
-        "tls": {"enabled": True},
+        "tag": tag,
+        "server": ep.host,
+        "server_port": ep.port,
+        "password": link.cred,
     }
-    if sni:
-        ob["tls"]["server_name"] = sni
-    if transport == "ws":
-        ob["transport"] = {"type": "ws", "path": path}
-        if host:
-            ob["transport"]["headers"] = {"Host": host}
+    return _tls_transport(ob, ep, link, grpc=False)
 
-    return ob
-
-
-def _ss_outbound(ep: Endpoint) -> dict:
-    s = ep.raw_line.strip()
-    if "#" in s:
-        s = s.split("#", 1)[0]
-    body = s[len("ss://"):].split("?", 1)[0]
-
-    if "@" in body:
-        left, right = body.split("@", 1)
-        left_dec = _b64_decode_any(left).decode("utf-8", errors="replace") if ":" not in left else left
-        method, password = left_dec.split(":", 1)
-        host, port_str = right.rsplit(":", 1)
-        server = host.strip("[]")
-        port = int(port_str)
-    else:
-        dec = _b64_decode_any(body).decode("utf-8", errors="replace")
-        creds, addr = dec.rsplit("@", 1)
-        method, password = creds.split(":", 1)
-        host, port_str = addr.rsplit(":", 1)
-        server = host.strip("[]")
-        port = int(port_str)
 
+def _ss_outbound(ep: Endpoint, tag: str = "proxy") -> dict:
+    link = link_of(ep)
     return {
         "type": "shadowsocks",
-        "tag": "proxy",
-        "server": server,
-        "server_port": port,
-        "method": method.strip(),
-        "password": password.strip(),
+        "tag": tag,
+        "server": ep.host,
+        "server_port": ep.port,
+        "method": link.method,
+        "password": link.cred,
     }
 
 
-def make_singbox_config(ep: Endpoint, socks_port: int) -> dict:
+def build_outbound(ep: Endpoint, tag: str = "proxy") -> dict:
     if ep.scheme == "vmess":
-        outbound = _vmess_outbound(ep)
-    elif ep.scheme == "vless":
-        outbound = _vless_outbound(ep)
-    elif ep.scheme == "trojan":
-        outbound = _trojan_outbound(ep)
-    elif ep.scheme == "ss":
-        outbound = _ss_outbound(ep)
-    else:
-        raise ValueError("unsupported scheme")
+        return _vmess_outbound(ep, tag)
+    if ep.scheme == "vless":
+        return _vless_outbound(ep, tag)
+    if ep.scheme == "trojan":
+        return _trojan_outbound(ep, tag)
+    if ep.scheme == "ss":
+        return _ss_outbound(ep, tag)
+    raise ValueError("unsupported scheme")
+
+
+# SNI to handshake with, or None when the endpoint does not use TLS
+def tls_target(ep: Endpoint) -> Optional[str]:
+    try:
+        link = link_of(ep)
+    except ValueError:
+        return None
+    return link.sni if link.tls else None
 
+
+def make_singbox_config(ep: Endpoint, socks_port: int) -> dict:
     return {
         "log": {"level": "error"},
         "inbounds": [{"type": "socks", "tag": "socks-in", "listen": "127.0.0.1", "listen_port": socks_port}],
-        "outbounds": [outbound, {"type": "direct", "tag": "direct"}],
+        "outbounds": [build_outbound(ep), {"type": "direct", "tag": "direct"}],
         "route": {"rules": [{"inbound": "socks-in", "outbound": "proxy"}], "auto_detect_interface": True},
     }
 
 
+def make_batch_singbox_config(members: List[Tuple[Endpoint, int]]) -> Tuple[dict, Dict[int, str]]:
+    # member i -> inbound "socks-in-i" -> outbound "proxy-i"; unbuildable members are left out
+    inbounds: List[dict] = []
+    outbounds: List[dict] = []
+    rules: List[dict] = []
+    errors: Dict[int, str] = {}
+
+    for i, (ep, socks_port) in enumerate(members):
+        try:
+            outbound = build_outbound(ep, f"proxy-{i}")
+        except Exception as e:
+            errors[i] = _short_dl_reason(e)
+            continue
+        inbounds.append({"type": "socks", "tag": f"socks-in-{i}", "listen": "127.0.0.1", "listen_port": socks_port})
+        outbounds.append(outbound)
+        rules.append({"inbound": f"socks-in-{i}", "outbound": f"proxy-{i}"})
+
+    outbounds.append({"type": "direct", "tag": "direct"})
+    cfg = {
+        "log": {"level": "error"},
+        "inbounds": inbounds,
+        "outbounds": outbounds,
+        "route": {"rules": rules, "auto_detect_interface": True},
+    }
+    return cfg, errors
+
+
+def _socks_get(socks_port: int, test_url: str, timeout: float) -> Tuple[bool, str, Optional[float], Optional[int]]:
+    proxies = {
+        "http": f"socks5h://127.0.0.1:{socks_port}",
+        "https": f"socks5h://127.0.0.1:{socks_port}",
+    }
+    start = time.perf_counter()
+    with METRICS.time("http_request"):
+        r = requests.get(test_url, proxies=proxies, timeout=timeout, allow_redirects=True)
+    ms = (time.perf_counter() - start) * 1000.0
+    ok = 200 <= r.status_code < 400
+    return ok, ("ok" if ok else "bad_status"), ms, r.status_code
+
+
+# log_path (truncated) receives sing-box's stderr, e.g. to spot rejected reloads
+def spawn_singbox(bin_name: str, cfg_path: str, log_path: Optional[str] = None) -> subprocess.Popen:
+    log = open(log_path, "wb") if log_path else subprocess.DEVNULL
+    try:
+        with METRICS.time("singbox_spawn"):
+            proc = subprocess.Popen([bin_name, "run", "-c", cfg_path], stdout=subprocess.DEVNULL, stderr=log)
+    finally:
+        if log_path:
+            log.close()
+    METRICS.inc("singbox_processes")
+    return proc
+
+
+# =========================
+# Readiness
+# =========================
+READY_TIMEOUT = 5.0
+
+
+def _socks_accepts(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2) as s:
+            s.settimeout(0.5)
+            s.sendall(b"\x05\x01\x00")
+            return s.recv(2) == b"\x05\x00"
+    except OSError:
+        return False
+
+
+# "ready" once every port answers a SOCKS5 greeting, "config_error" if sing-box exits
+# first (or, given its log and the log size before a SIGHUP, reports the reload as
+# rejected), "not_ready" when the deadline passes.
+def wait_socks_ready(
+    proc: subprocess.Popen,
+    ports: List[int],
+    deadline: float = READY_TIMEOUT,
+    log_path: Optional[str] = None,
+    log_from: int = 0,
+) -> str:
+    with METRICS.time("singbox_ready"):
+        state = _poll_ready(proc, ports, deadline, log_path, log_from)
+    if state != "ready":
+        METRICS.fail("singbox_ready", state)
+    return state
+
+
+# sing-box keeps the old config running and logs "reload service: ..." when a
+# SIGHUP'd config is invalid
+def _reload_rejected(log_path: str, log_from: int) -> bool:
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(log_from)
+            text = f.read().lower()
+    except OSError:
+        return False
+    return b"reload" in text or b"fatal" in text
+
+
+def _poll_ready(
+    proc: subprocess.Popen, ports: List[int], deadline: float, log_path: Optional[str] = None, log_from: int = 0
+) -> str:
+    end = time.monotonic() + deadline
+    pending = list(ports)
+    delay = 0.01
+    while True:
+        if proc.poll() is not None:
+            return "config_error"
+        if log_path and _reload_rejected(log_path, log_from):
+            return "config_error"
+        while pending and _socks_accepts(pending[0]):
+            pending.pop(0)
+        if not pending:
+            return "ready"
+        if time.monotonic() >= end:
+            return "not_ready"
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+
 def real_download_test(
     ep: Endpoint,
     *,
@@ -215,11 +299,15 @@ def real_download_test(
     bin_name: str,
     test_url: str,
     timeout: float,
+    ready_timeout: float = READY_TIMEOUT,
 ) -> Tuple[bool, str, Optional[float], Optional[int]]:
     if not (enabled and has_singbox(bin_name)):
         return False, "skipped", None, None
 
-    socks_port = _alloc_socks_port(ep)
+    try:
+        socks_port = PORTS.lease()
+    except RuntimeError:
+        return False, "no_port", None, None
     tmpdir = tempfile.mkdtemp(prefix="scan_")
     cfg_path = os.path.join(tmpdir, "config.json")
 
@@ -227,18 +315,12 @@ def real_download_test(
         with open(cfg_path, "w", encoding="utf-8") as f:
             json.dump(make_singbox_config(ep, socks_port), f)
 
-        p = subprocess.Popen([bin_name, "run", "-c", cfg_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        p = spawn_singbox(bin_name, cfg_path)
         try:
-            time.sleep(0.8)
-            proxies = {
-                "http": f"socks5h://127.0.0.1:{socks_port}",
-                "https": f"socks5h://127.0.0.1:{socks_port}",
-            }
-            start = time.perf_counter()
-            r = requests.get(test_url, proxies=proxies, timeout=timeout, allow_redirects=True)
-            ms = (time.perf_counter() - start) * 1000.0
-            ok = 200 <= r.status_code < 400
-            return ok, ("ok" if ok else "bad_status"), ms, r.status_code
+            state = wait_socks_ready(p, [socks_port], ready_timeout)
+            if state != "ready":
+                return False, state, None, None
+            return _socks_get(socks_port, test_url, timeout)
         except Exception as e:
             return False, _short_dl_reason(e), None, None
         finally:
@@ -248,9 +330,402 @@ def real_download_test(
             except Exception:
                 pass
     finally:
+        PORTS.release(socks_port)
         try:
             if os.path.exists(cfg_path):
                 os.remove(cfg_path)
             os.rmdir(tmpdir)
         except Exception:
             pass
+
+
+# =========================
+# Batched engine
+# =========================
+class _BatchGroup:
+    def __init__(self) -> None:
+        self.members: List[Endpoint] = []
+        self.ports: List[int] = []
+        self.errors: Dict[int, str] = {}
+        self.sealed = False
+        self.started = threading.Event()
+        self.failed = False
+        self.remaining = 0
+        self.proc: Optional[subprocess.Popen] = None
+        self.tmpdir: Optional[str] = None
+        self.delays: Dict[int, int] = {}
+
+
+# Concurrent callers join an open group; whoever fills it (or the first caller after
+# `linger` seconds) starts one sing-box for the whole group, and the last one out stops it.
+class SingboxBatcher:
+    def __init__(self, bin_name: str, batch_size: int, linger: float = 0.5, ready_timeout: float = READY_TIMEOUT) -> None:
+        self.bin_name = bin_name
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.ready_timeout = ready_timeout
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._open: Optional[_BatchGroup] = None
+
+    def download_test(self, ep: Endpoint, *, test_url: str, timeout: float) -> Tuple[bool, str, Optional[float], Optional[int]]:
+        with self._lock:
+            g = self._open
+            if g is None:
+                g = self._open = _BatchGroup()
+            slot = len(g.members)
+            g.members.append(ep)
+            launch = len(g.members) >= self.batch_size and self._seal(g)
+
+        if launch:
+            self._launch(g, test_url, timeout)
+        elif slot == 0 and not g.started.wait(self.linger):
+            with self._lock:
+                launch = self._seal(g)
+            if launch:
+                self._launch(g, test_url, timeout)
+        g.started.wait()
+
+        try:
+            if g.failed:
+                return real_download_test(
+                    ep,
+                    enabled=True,
+                    bin_name=self.bin_name,
+                    test_url=test_url,
+                    timeout=timeout,
+                    ready_timeout=self.ready_timeout,
+                )
+            if slot in g.errors:
+                return False, g.errors[slot], None, None
+            return self._member_result(g, slot, test_url, timeout)
+        finally:
+            self._leave(g)
+
+    def stats(self) -> Dict[str, int]:
+        return {"batches": self.batches}
+
+    def close(self) -> None:
+        pass
+
+    def _seal(self, g: _BatchGroup) -> bool:
+        if g.sealed:
+            return False
+        g.sealed = True
+        g.remaining = len(g.members)
+        if self._open is g:
+            self._open = None
+        return True
+
+    def _launch(self, g: _BatchGroup, test_url: str, timeout: float) -> None:
+        try:
+            self._start_group(g, test_url, timeout)
+        except Exception:
+            g.failed = True
+        finally:
+            g.started.set()
+
+    def _spawn(self, g: _BatchGroup, cfg: dict, ports: List[int]) -> bool:
+        g.tmpdir = tempfile.mkdtemp(prefix="scan_batch_")
+        cfg_path = os.path.join(g.tmpdir, "config.json")
+        with open(cfg_path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f)
+
+        g.proc = spawn_singbox(self.bin_name, cfg_path)
+        self.batches += 1
+        return wait_socks_ready(g.proc, ports, self.ready_timeout) == "ready"
+
+    def _start_group(self, g: _BatchGroup, test_url: str, timeout: float) -> None:
+        g.ports = PORTS.lease_many(len(g.members))
+        cfg, g.errors = make_batch_singbox_config(list(zip(g.members, g.ports)))
+        ports = [p for i, p in enumerate(g.ports) if i not in g.errors]
+        if ports and not self._spawn(g, cfg, ports):
+            g.failed = True
+
+    def _member_result(self, g: _BatchGroup, slot: int, test_url: str, timeout: float) -> Tuple[bool, str, Optional[float], Optional[int]]:
+        try:
+            return _socks_get(g.ports[slot], test_url, timeout)
+        except Exception as e:
+            return False, _short_dl_reason(e), None, None
+
+    def _leave(self, g: _BatchGroup) -> None:
+        with self._lock:
+            g.remaining -= 1
+            last = g.remaining == 0
+        if not last:
+            return
+        if g.proc is not None:
+            try:
+                g.proc.terminate()
+                g.proc.wait(timeout=2)
+            except Exception:
+                pass
+        PORTS.release_many(g.ports)
+        if g.tmpdir:
+            shutil.rmtree(g.tmpdir, ignore_errors=True)
+
+
+# =========================
+# Clash API bulk delay
+# =========================
+CLASH_GROUP = "scan-group"
+
+
+class ClashApi:
+    def __init__(self, base_url: str, secret: str = "") -> None:
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {secret}"} if secret else {}
+
+    def ready(self) -> bool:
+        try:
+            return requests.get(self.base_url + "/", headers=self.headers, timeout=0.5).status_code == 200
+        except requests.RequestException:
+            return False
+
+    # {tag: delay_ms} for every member of the group that answered; failed members are absent
+    def group_delay(self, group: str, test_url: str, timeout_ms: int, http_timeout: float) -> Dict[str, int]:
+        r = requests.get(
+            f"{self.base_url}/group/{quote(group, safe='')}/delay",
+            params={"url": test_url, "timeout": timeout_ms},
+            headers=self.headers,
+            timeout=http_timeout,
+        )
+        r.raise_for_status()
+        return {k: int(v) for k, v in r.json().items() if isinstance(v, (int, float)) and v > 0}
+
+    def proxy_delay(self, tag: str, test_url: str, timeout_ms: int) -> Optional[int]:
+        r = requests.get(
+            f"{self.base_url}/proxies/{quote(tag, safe='')}/delay",
+            params={"url": test_url, "timeout": timeout_ms},
+            headers=self.headers,
+            timeout=timeout_ms / 1000.0 + 2,
+        )
+        if r.status_code != 200:
+            return None
+        delay = r.json().get("delay")
+        return int(delay) if delay else None
+
+
+def make_clash_singbox_config(members: List[Endpoint], controller_port: int, secret: str) -> Tuple[dict, Dict[int, str]]:
+    outbounds: List[dict] = []
+    tags: List[str] = []
+    errors: Dict[int, str] = {}
+
+    for i, ep in enumerate(members):
+        try:
+            outbounds.append(build_outbound(ep, f"proxy-{i}"))
+            tags.append(f"proxy-{i}")
+        except Exception as e:
+            errors[i] = _short_dl_reason(e)
+
+    outbounds.append({"type": "selector", "tag": CLASH_GROUP, "outbounds": tags or ["direct"]})
+    outbounds.append({"type": "direct", "tag": "direct"})
+    cfg = {
+        "log": {"level": "error"},
+        "inbounds": [],
+        "outbounds": outbounds,
+        "route": {"final": "direct", "auto_detect_interface": True},
+        "experimental": {
+            "clash_api": {"external_controller": f"127.0.0.1:{controller_port}", "secret": secret},
+        },
+    }
+    return cfg, errors
+
+
+# Same grouping as SingboxBatcher, but the launcher asks sing-box itself to measure every
+# outbound of the group (GET /group/<name>/delay) and members just read their entry.
+# The numbers are sing-box URL-test delays, reported through dl_ms with no HTTP status.
+class ClashDelayBatcher(SingboxBatcher):
+    def __init__(
+        self,
+        bin_name: str,
+        batch_size: int,
+        linger: float = 0.5,
+        ready_timeout: float = READY_TIMEOUT,
+        api_url: Optional[str] = None,
+    ) -> None:
+        super().__init__(bin_name, batch_size, linger, ready_timeout)
+        self.api_url = api_url
+
+    def _start_group(self, g: _BatchGroup, test_url: str, timeout: float) -> None:
+        timeout_ms = int(timeout * 1000)
+        if self.api_url:
+            api = ClashApi(self.api_url)
+            g.errors = {}
+        else:
+            secret = os.urandom(8).hex()
+            controller_port = PORTS.lease()
+            g.ports = [controller_port]
+            cfg, g.errors = make_clash_singbox_config(g.members, controller_port, secret)
+            if len(g.errors) == len(g.members):
+                return
+            if not self._spawn(g, cfg, []):
+                g.failed = True
+                return
+            api = ClashApi(f"http://127.0.0.1:{controller_port}", secret)
+            deadline = time.monotonic() + self.ready_timeout
+            while not api.ready():
+                if g.proc.poll() is not None or time.monotonic() > deadline:
+                    g.failed = True
+                    return
+                time.sleep(0.05)
+
+        # sing-box URL-tests a group about 10 outbounds at a time
+        http_timeout = timeout * (len(g.members) // 10 + 1) + 5
+        try:
+            delays = api.group_delay(CLASH_GROUP, test_url, timeout_ms, http_timeout)
+        except requests.RequestException:
+            delays = {}
+            for i in range(len(g.members)):
+                if i in g.errors:
+                    continue
+                try:
+                    d = api.proxy_delay(f"proxy-{i}", test_url, timeout_ms)
+                except requests.RequestException:
+                    d = None
+                if d:
+                    delays[f"proxy-{i}"] = d
+        g.delays = {int(tag.split("-", 1)[1]): d for tag, d in delays.items() if tag.startswith("proxy-")}
+
+    def _member_result(self, g: _BatchGroup, slot: int, test_url: str, timeout: float) -> Tuple[bool, str, Optional[float], Optional[int]]:
+        if slot in g.delays:
+            return True, "ok", float(g.delays[slot]), None
+        return False, "timeout", None, None
+
+
+# =========================
+# Persistent worker pool
+# =========================
+class _SingboxWorker:
+    def __init__(self, bin_name: str) -> None:
+        self.bin_name = bin_name
+        self.tmpdir = tempfile.mkdtemp(prefix="scan_worker_")
+        self.cfg_path = os.path.join(self.tmpdir, "config.json")
+        self.log_path = os.path.join(self.tmpdir, "stderr.log")
+        self.proc: Optional[subprocess.Popen] = None
+        self.port: Optional[int] = None
+        self.tests = 0
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    # Every swap listens on a fresh port, so a reload sing-box rejected (it keeps
+    # the old config running) can never be mistaken for the new outbound; the
+    # rejection itself is read from sing-box's log so the swap fails right away.
+    def swap(self, ep: Endpoint, ready_timeout: float) -> Tuple[Optional[int], str]:
+        try:
+            cfg = make_singbox_config(ep, 0)
+        except Exception as e:
+            return None, _short_dl_reason(e)
+        try:
+            socks_port = PORTS.lease()
+        except RuntimeError:
+            return None, "no_port"
+        cfg["inbounds"][0]["listen_port"] = socks_port
+
+        tmp_path = self.cfg_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f)
+        os.replace(tmp_path, self.cfg_path)
+
+        log_from = 0
+        if self.alive() and hasattr(signal, "SIGHUP"):
+            try:
+                log_from = os.path.getsize(self.log_path)
+            except OSError:
+                pass
+            self.proc.send_signal(signal.SIGHUP)
+            METRICS.inc("singbox_reloads")
+        else:
+            self.stop_process()
+            self.proc = spawn_singbox(self.bin_name, self.cfg_path, self.log_path)
+        if self.port is not None:
+            PORTS.release(self.port)
+        self.port = socks_port
+
+        state = wait_socks_ready(self.proc, [socks_port], ready_timeout, self.log_path, log_from)
+        if state != "ready":
+            return None, state
+        return socks_port, "ok"
+
+    def stop_process(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.terminate()
+            self.proc.wait(timeout=2)
+        except Exception:
+            pass
+        self.proc = None
+        if self.port is not None:
+            PORTS.release(self.port)
+            self.port = None
+
+    def close(self) -> None:
+        self.stop_process()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+# `size` long-lived sing-box processes for the whole scan; each test hot-swaps the
+# worker's outbound by config reload. Crashed workers are respawned on their next
+# swap and every worker is recycled after `max_tests` tests.
+class SingboxWorkerPool:
+    def __init__(self, bin_name: str, size: int, max_tests: int = 50, ready_timeout: float = READY_TIMEOUT) -> None:
+        self.bin_name = bin_name
+        self.max_tests = max(1, max_tests)
+        self.ready_timeout = ready_timeout
+        self.restarts = 0
+        self.recycles = 0
+        self._workers = [_SingboxWorker(bin_name) for _ in range(max(1, size))]
+        self.capacity = len(self._workers)  # tests that can run at once
+        self._idle: "queue.Queue[_SingboxWorker]" = queue.Queue()
+        for w in self._workers:
+            self._idle.put(w)
+
+    def download_test(self, ep: Endpoint, *, test_url: str, timeout: float) -> Tuple[bool, str, Optional[float], Optional[int]]:
+        w = self._idle.get()
+        try:
+            if w.proc is not None and not w.alive():
+                self.restarts += 1
+                METRICS.inc("singbox_restarts")
+            socks_port, reason = w.swap(ep, self.ready_timeout)
+            if socks_port is None:
+                return False, reason, None, None
+            try:
+                return _socks_get(socks_port, test_url, timeout)
+            except Exception as e:
+                return False, _short_dl_reason(e), None, None
+        finally:
+            w.tests += 1
+            if w.tests >= self.max_tests:
+                w.stop_process()
+                w.tests = 0
+                self.recycles += 1
+                METRICS.inc("singbox_recycles")
+            self._idle.put(w)
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.capacity, "restarts": self.restarts, "recycles": self.recycles}
+
+    def close(self) -> None:
+        for w in self._workers:
+            w.close()
+
+
+def make_download_engine(
+    mode: str,
+    bin_name: str,
+    *,
+    batch_size: int,
+    linger: float = 0.5,
+    pool_size: int = 16,
+    max_tests: int = 50,
+    ready_timeout: float = READY_TIMEOUT,
+):
+    if mode == "batch":
+        return SingboxBatcher(bin_name, batch_size, linger, ready_timeout)
+    if mode == "pool":
+        return SingboxWorkerPool(bin_name, pool_size, max_tests, ready_timeout)
+    if mode == "clash":
+        return ClashDelayBatcher(bin_name, batch_size, linger, ready_timeout)
+    return None